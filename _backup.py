@@ -16,6 +16,7 @@ import time
 from googlesearch import search
 import validators
 from dotenv import load_dotenv
+from pending_filter import PendingInputIndex, PendingInputFilter
 
 # Set up logging
 logging.basicConfig(
@@ -114,6 +115,13 @@ COOLDOWN_STORAGE = {}  # {f"{chat_id}_{user_id}": timestamp}
 ACTIVE_REQUESTS = {}  # {f"{chat_id}_{user_id}": bool}
 USER_REQUEST_COUNTS = {}  # {f"{chat_id}_{user_id}": [timestamps]}
 APPROVED_USERS = {}  # {chat_id: {user_id: True}}
+TOKEN_INPUT_TTL = 600  # seconds a new member has to reply with their token
+AWAITING_TOKEN = PendingInputIndex("tokens", ttl=TOKEN_INPUT_TTL)  # users asked for a token
+
+# Ask a user for their token: the reply handler only sees users registered in AWAITING_TOKEN
+def await_token(context, user_id, chat_id, group_name, request_message_id):
+    context.user_data['awaiting_token'] = {'chat_id': chat_id, 'group_name': group_name, 'request_message_id': request_message_id}
+    AWAITING_TOKEN.add(user_id)
 
 # Placeholder for searching an image URL
 async def search_image_url(ticker):
@@ -381,7 +389,7 @@ async def handle_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 msg = await update.message.reply_text(
                     f"Yo, slime fam! 😎 Welcome to {group_name}! To use {ticker} bot commands, reply here with a valid 10-character token (uppercase letters and digits). Got one? Send it now!"
                 )
-                context.user_data['awaiting_token'] = {'chat_id': chat_id, 'group_name': group_name, 'request_message_id': msg.message_id}
+                await_token(context, user_id, chat_id, group_name, msg.message_id)
                 logger.info(f"Requested token from user {user_id} for chat {chat_id}")
             except TelegramError as e:
                 logger.error(f"Failed to send token request to user {user_id} in chat {chat_id}: {str(e)}")
@@ -392,6 +400,7 @@ async def handle_token_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     if 'awaiting_token' not in context.user_data:
+        AWAITING_TOKEN.discard(user_id)
         return
     
     token = update.message.text.strip()
@@ -444,6 +453,7 @@ async def handle_token_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         except TelegramError as e:
             logger.error(f"Failed to send welcome message to user {user_id}: {str(e)}")
         del context.user_data['awaiting_token']
+        AWAITING_TOKEN.discard(user_id)
     else:
         try:
             msg = await update.message.reply_text(
@@ -536,7 +546,7 @@ async def suimeme(update: Update, context: ContextTypes.DEFAULT_TYPE):
         msg = await update.message.reply_text(
             f"Yo, slime fam! 😅 To use {ticker} bot commands in {group_name}, reply here with a valid 10-character token (uppercase letters and digits). Got one? Send it now!"
         )
-        context.user_data['awaiting_token'] = {'chat_id': chat_id, 'group_name': group_name, 'request_message_id': msg.message_id}
+        await_token(context, user_id, chat_id, group_name, msg.message_id)
         logger.info(f"User {user_id} in chat {chat_id} is not approved, requested token")
         return
 
@@ -729,7 +739,7 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         msg = await update.message.reply_text(
             f"Yo, slime fam! 😅 To use {ticker} bot commands in {group_name}, reply here with a valid 10-character token (uppercase letters and digits). Got one? Send it now!"
         )
-        context.user_data['awaiting_token'] = {'chat_id': chat_id, 'group_name': group_name, 'request_message_id': msg.message_id}
+        await_token(context, user_id, chat_id, group_name, msg.message_id)
         logger.info(f"User {user_id} in chat {chat_id} is not approved, requested token")
         return
 
@@ -817,7 +827,7 @@ async def hey(update: Update, context: ContextTypes.DEFAULT_TYPE):
         msg = await update.message.reply_text(
             f"Yo, slime fam! 😅 To use {ticker} bot commands in {group_name}, reply here with a valid 10-character token (uppercase letters and digits). Got one? Send it now!"
         )
-        context.user_data['awaiting_token'] = {'chat_id': chat_id, 'group_name': group_name, 'request_message_id': msg.message_id}
+        await_token(context, user_id, chat_id, group_name, msg.message_id)
         logger.info(f"User {user_id} in chat {chat_id} is not approved, requested token")
         return
     
@@ -952,7 +962,7 @@ async def start_com(update: Update, context: ContextTypes.DEFAULT_TYPE):
         msg = await update.message.reply_text(
             f"Yo, slime fam! 😅 To use {ticker} bot commands in {group_name}, reply here with a valid 10-character token (uppercase letters and digits). Got one? Send it now!"
         )
-        context.user_data['awaiting_token'] = {'chat_id': chat_id, 'group_name': group_name, 'request_message_id': msg.message_id}
+        await_token(context, user_id, chat_id, group_name, msg.message_id)
         logger.info(f"User {user_id} in chat {chat_id} is not approved, requested token")
         return
 
@@ -990,7 +1000,7 @@ async def how(update: Update, context: ContextTypes.DEFAULT_TYPE):
         msg = await update.message.reply_text(
             f"Yo, slime fam! 😅 To use {ticker} bot commands in {group_name}, reply here with a valid 10-character token (uppercase letters and digits). Got one? Send it now!"
         )
-        context.user_data['awaiting_token'] = {'chat_id': chat_id, 'group_name': group_name, 'request_message_id': msg.message_id}
+        await_token(context, user_id, chat_id, group_name, msg.message_id)
         logger.info(f"User {user_id} in chat {chat_id} is not approved, requested token")
         return
 
@@ -1020,7 +1030,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         msg = await update.message.reply_text(
             f"Yo, slime fam! 😅 To use {ticker} bot commands in {group_name}, reply here with a valid 10-character token (uppercase letters and digits). Got one? Send it now!"
         )
-        context.user_data['awaiting_token'] = {'chat_id': chat_id, 'group_name': group_name, 'request_message_id': msg.message_id}
+        await_token(context, user_id, chat_id, group_name, msg.message_id)
         logger.info(f"User {user_id} in chat {chat_id} is not approved, requested token")
         return
 
@@ -1044,7 +1054,7 @@ async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         msg = await update.message.reply_text(
             f"Yo, slime fam! 😅 To use {ticker} bot commands in {group_name}, reply here with a valid 10-character token (uppercase letters and digits). Got one? Send it now!"
         )
-        context.user_data['awaiting_token'] = {'chat_id': chat_id, 'group_name': group_name, 'request_message_id': msg.message_id}
+        await_token(context, user_id, chat_id, group_name, msg.message_id)
         logger.info(f"User {user_id} in chat {chat_id} is not approved, requested token")
         return
 
@@ -1092,7 +1102,7 @@ def main():
     application.add_handler(CommandHandler(["hey", "HEY"], hey))
     application.add_handler(CommandHandler(["settings", "SETTINGS"], settings))
     application.add_handler(CallbackQueryHandler(button_callback))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_token_input))
+    application.add_handler(MessageHandler(PendingInputFilter(AWAITING_TOKEN, by="user") & filters.TEXT & ~filters.COMMAND, handle_token_input))
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, handle_new_member))
     application.add_handler(CommandHandler(["start", "START"], start_com))
     application.add_handler(CommandHandler(["how", "HOW"], how))
@@ -0,0 +1,44 @@
+import json
+import random
+import time
+
+from responder import Responder
+
+# Throughput of /hey intent classification and reply rendering.
+# Usage: python bench_responder.py [messages]
+MESSAGES = [
+    "gm fam", "is this a rug pull?", "wen moon lfg", "whats the price rn", "how do I connect my sui wallet",
+    "what is the CA", "this bot sucks", "asdf", "where is the website", "huh wtf is going on",
+    "any airdrop coming?", "roadmap?", "how does this work?",
+    "yo slime king I just bought more and the chart looks bullish, is there a snapshot for the next airdrop or what",
+    "ok"
+]
+
+def load():
+    with open("responses.json", "r", encoding="utf-8") as f:
+        responses = json.load(f)
+    with open("dynamic_words.json", "r", encoding="utf-8") as f:
+        dynamic_words = json.load(f)
+    return responses, dynamic_words
+
+def run(label, func, total):
+    messages = [MESSAGES[i % len(MESSAGES)] for i in range(total)]
+    started = time.perf_counter()
+    for message in messages:
+        func(message)
+    elapsed = time.perf_counter() - started
+    print(f"{label:>9}: {total / elapsed:10.0f} msg/s  {elapsed / total * 1e6:6.2f}us/msg")
+
+def main():
+    import sys
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    responses, dynamic_words = load()
+    started = time.perf_counter()
+    responder = Responder(responses, dynamic_words)
+    print(f"  compile: {(time.perf_counter() - started) * 1000:.2f}ms")
+    rng = random.Random(0)
+    run("classify", responder.classify, total)
+    run("reply", lambda message: responder.reply(message, "bench", rng), total)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+from sui_rpc import SuiRpcClient
+
+# Runs SuiRpcClient against a local mock Sui JSON-RPC server and reports how many
+# upstream requests many groups asking about the same coins produce.
+# Usage: python bench_sui_rpc.py [groups] [distinct coins]
+COIN_TYPE = "0xeded589fe72aef12b3b22a826723854820c8480023f3a0ef49460f8429b8d080::suimeme::SUIMEME"
+MOCK_LATENCY = 0.05  # seconds per upstream request
+
+mock = FastAPI()
+upstream = {'requests': 0, 'calls': 0}
+# Set 'mode' to make the mock misbehave (used by the tests): "batch_error" answers the whole
+# batch with one error object, "not_json" with an HTML page, "not_list" with a bare number,
+# "no_ids" with results that match no request, "odd_shapes" with well-formed replies whose
+# coin metadata and supply have the wrong shape (picked by the coin's symbol, see ODD_SHAPES)
+faults = {'mode': None}
+ODD_SHAPES = {
+    "LIST": ("suix_getCoinMetadata", ["not", "an", "object"]),
+    "TEXT": ("suix_getCoinMetadata", {"decimals": "6", "name": "Text", "symbol": "TEXT"}),
+    "NULL": ("suix_getCoinMetadata", {"decimals": None, "name": "Null", "symbol": "NULL"}),
+    "NOVALUE": ("suix_getTotalSupply", {"amount": "1"}),
+}
+# {sender address: [transaction blocks, newest first]} served by suix_queryTransactionBlocks
+transactions = {}
+
+def handle(call):
+    method, params = call["method"], call["params"]
+    if faults['mode'] == "odd_shapes" and params:
+        odd_method, odd_result = ODD_SHAPES.get(str(params[0]).rsplit("::", 1)[-1], (None, None))
+        if method == odd_method:
+            return {"jsonrpc": "2.0", "id": call["id"], "result": odd_result}
+    if method == "suix_getCoinMetadata":
+        symbol = params[0].rsplit("::", 1)[-1]
+        result = {"decimals": 6, "name": symbol.title(), "symbol": symbol, "description": "", "iconUrl": None}
+    elif method == "suix_getTotalSupply":
+        result = {"value": "1000000000000000"}
+    elif method == "suix_getBalance":
+        result = {"coinType": params[1], "coinObjectCount": 1, "totalBalance": str(len(params[0]) * 10 ** 6)}
+    elif method == "suix_queryTransactionBlocks":
+        sender = params[0]["filter"]["FromAddress"]
+        result = {"data": transactions.get(sender, [])[:params[2]], "nextCursor": None, "hasNextPage": False}
+    elif method == "mock_stringError":
+        # Non-standard nodes send the error as a bare string
+        return {"jsonrpc": "2.0", "id": call["id"], "error": "node is syncing"}
+    else:
+        return {"jsonrpc": "2.0", "id": call["id"], "error": {"code": -32601, "message": f"Method not found: {method}"}}
+    return {"jsonrpc": "2.0", "id": call["id"], "result": result}
+
+@mock.post("/")
+async def rpc(request: Request):
+    body = json.loads(await request.body())
+    calls = body if isinstance(body, list) else [body]
+    upstream['requests'] += 1
+    upstream['calls'] += len(calls)
+    await asyncio.sleep(MOCK_LATENCY)
+    mode = faults['mode']
+    if mode == "batch_error":
+        return {"jsonrpc": "2.0", "id": None, "error": {"code": -32005, "message": "Too many requests"}}
+    if mode == "not_json":
+        return Response("<html>502 Bad Gateway</html>", media_type="text/html")
+    if mode == "not_list":
+        return 42
+    if mode == "no_ids":
+        return [{"jsonrpc": "2.0", "id": 10 ** 9 + i, "result": None} for i in range(len(calls))]
+    results = [handle(call) for call in calls]
+    return results if isinstance(body, list) else results[0]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server():
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(mock, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, port
+
+async def wave(client, groups, coins):
+    coin_types = [COIN_TYPE] + [f"0x{i:064x}::meme::MEME{i}" for i in range(1, coins)]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(client.get_coin_info(coin_types[i % coins]) for i in range(groups)))
+    assert all(result['supply'] == 1e9 for result in results)
+    return time.perf_counter() - started
+
+async def run(groups, coins, port):
+    client = SuiRpcClient(f"http://127.0.0.1:{port}/")
+    try:
+        for label in ("cold", "cached"):
+            before = dict(upstream)
+            elapsed = await wave(client, groups, coins)
+            print(f"{label:>6}: {groups} groups, {coins} coins -> {upstream['requests'] - before['requests']} upstream "
+                  f"requests ({upstream['calls'] - before['calls']} calls) in {elapsed * 1000:.1f}ms")
+        balances = await asyncio.gather(*(client.get_balance(f"0x{i:x}", COIN_TYPE) for i in range(200)))
+        assert len(balances) == 200
+        print(f"balances: 200 owners -> {upstream['requests']} upstream requests so far")
+    finally:
+        await client.close()
+
+def main():
+    import sys
+    groups = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    coins = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    server, thread, port = start_server()
+    try:
+        asyncio.run(run(groups, coins, port))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+if __name__ == "__main__":
+    main()
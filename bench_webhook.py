@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+
+# Benchmarks the /webhook route in-process: standard path vs FAST_WEBHOOK path.
+# Usage: python bench_webhook.py [requests] [concurrency]
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:BENCHMARK")
+
+import httpx
+import uvicorn
+
+import suimeme_bot
+
+UPDATE_BODY = json.dumps({
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 1700000000,
+        "chat": {"id": -100123, "type": "supergroup", "title": "bench"},
+        "from": {"id": 42, "is_bot": False, "first_name": "bench"},
+        "text": "/help",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 5}]
+    }
+}).encode("utf-8")
+
+HEADERS = {
+    "Content-Type": "application/json",
+    "X-Telegram-Bot-Api-Secret-Token": suimeme_bot.WEBHOOK_SECRET
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(fast):
+    suimeme_bot.FAST_WEBHOOK = fast
+    port = free_port()
+    config = uvicorn.Config(suimeme_bot.app, host="127.0.0.1", port=port, log_level="warning",
+                            **suimeme_bot.uvicorn_options(fast))
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, port
+
+async def load(port, total, concurrency):
+    latencies = []
+    remaining = total
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits) as client:
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                response = await client.post("/webhook", content=UPDATE_BODY, headers=HEADERS)
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'rps': total / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000
+    }
+
+def run(fast, total, concurrency):
+    server, thread, port = start_server(fast)
+    try:
+        asyncio.run(load(port, min(200, total), concurrency))  # warm-up
+        return asyncio.run(load(port, total, concurrency))
+    finally:
+        server.should_exit = True
+        thread.join()
+        # Updates are only queued here; drop them between runs
+        queue = suimeme_bot.application.update_queue
+        while not queue.empty():
+            queue.get_nowait()
+
+def main():
+    import sys
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    for label, fast in (("standard", False), ("fast", True)):
+        result = run(fast, total, concurrency)
+        print(f"{label:>8}: {result['rps']:8.0f} req/s  p50 {result['p50_ms']:6.2f}ms  p99 {result['p99_ms']:6.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+
+# Defaults every chat starts from; unset fields point at these shared (interned) strings
+# instead of holding a copy per chat
+DEFAULTS = {
+    'main_character': sys.intern("Blue Slime King"),
+    'ticker': sys.intern("$SUIMEME"),
+    'character_image': None,
+    'contract_address': sys.intern("0xeded589fe72aef12b3b22a826723854820c8480023f3a0ef49460f8429b8d080::suimeme::SUIMEME"),
+    'telegram': sys.intern("https://t.me/suimeme"),
+    'twitter': sys.intern("https://x.com/sui_meme_sui/"),
+    'website': sys.intern("https://sui-meme.com/"),
+    'min_holding': None  # whole tokens a member must hold to use the bot; None = no holder gate
+}
+FIELDS = tuple(DEFAULTS)
+
+# One chat's settings. Fields are plain slot attributes; only values that differ from
+# DEFAULTS take memory of their own and only those are serialized.
+class ChatSettings:
+    __slots__ = FIELDS + ('image_searched', 'pending_setting')
+
+    def __init__(self, **overrides):
+        for name in FIELDS:
+            setattr(self, name, DEFAULTS[name])
+        self.image_searched = False  # character_image was looked up (it may still be None)
+        self.pending_setting = None  # settings button waiting for the admin's text reply
+        for name, value in overrides.items():
+            self.set(name, value)
+
+    def set(self, name, value):
+        if name not in DEFAULTS:
+            raise AttributeError(f"Unknown chat setting {name!r}")
+        if isinstance(value, str):
+            value = sys.intern(value)
+        setattr(self, name, value)
+        if name == 'character_image':
+            self.image_searched = True
+
+    # Compact form: only overridden fields (character_image also once it has been looked up)
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in FIELDS if getattr(self, name) != DEFAULTS[name]}
+        if self.image_searched:
+            data['character_image'] = self.character_image
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: value for name, value in data.items() if name in DEFAULTS})
+
+    def __repr__(self):
+        return f"ChatSettings({self.to_dict()!r})"
+
+# {chat_id: ChatSettings} from the JSON file written by write_chat_settings
+def load_chat_settings(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return {int(chat_id): ChatSettings.from_dict(overrides) for chat_id, overrides in data.items()}
+
+# data: {chat_id: to_dict()}; written to a temp file and renamed so a crash never leaves half a file
+def write_chat_settings(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({str(chat_id): overrides for chat_id, overrides in data.items()}, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Circuit breaker driven by error rate and slow-call rate over a sliding window
+class CircuitBreaker:
+    def __init__(self, name, window=60, min_calls=5, error_rate=0.5, slow_call_rate=0.5,
+                 slow_call_seconds=60, open_seconds=30, half_open_calls=1):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.opened_at = 0
+        self.half_open_in_flight = 0
+        self.calls = deque()  # [(timestamp, ok, latency)]
+        metrics.set_gauge(f"breaker.{self.name}.state", self.state)
+
+    def _transition(self, state):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+        metrics.set_gauge(f"breaker.{self.name}.state", state)
+        metrics.inc(f"breaker.{self.name}.to_{state}")
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if state != HALF_OPEN:
+            self.half_open_in_flight = 0
+        if state == CLOSED:
+            self.calls.clear()
+
+    def _trim(self, now):
+        while self.calls and now - self.calls[0][0] > self.window:
+            self.calls.popleft()
+
+    # Seconds until an open breaker lets a trial call through
+    def retry_after(self):
+        if self.state != OPEN:
+            return 0
+        return max(0, self.open_seconds - (time.monotonic() - self.opened_at))
+
+    # Non-consuming check, safe to call before doing any work for a request
+    def is_open(self):
+        if self.state == OPEN and self.retry_after() > 0:
+            return True
+        if self.state == HALF_OPEN and self.half_open_in_flight >= self.half_open_calls:
+            return True
+        return False
+
+    # Consuming check; every True must be followed by record_success or record_failure
+    def allow_request(self):
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                metrics.inc(f"breaker.{self.name}.rejected")
+                return False
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.half_open_in_flight >= self.half_open_calls:
+                metrics.inc(f"breaker.{self.name}.rejected")
+                return False
+            self.half_open_in_flight += 1
+        return True
+
+    # Give back a permit from allow_request when the call never reached the backend
+    def release_unused(self):
+        if self.state == HALF_OPEN:
+            self.half_open_in_flight = max(0, self.half_open_in_flight - 1)
+
+    def record_success(self, latency):
+        self._record(True, latency)
+
+    def record_failure(self, latency):
+        self._record(False, latency)
+
+    def _record(self, ok, latency):
+        now = time.monotonic()
+        slow = latency >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            self.half_open_in_flight = max(0, self.half_open_in_flight - 1)
+            self._transition(CLOSED if ok and not slow else OPEN)
+            return
+        if self.state == OPEN:
+            return
+        self.calls.append((now, ok, latency))
+        self._trim(now)
+        total = len(self.calls)
+        if total < self.min_calls:
+            return
+        failures = sum(1 for _, call_ok, _ in self.calls if not call_ok)
+        slow_calls = sum(1 for _, _, call_latency in self.calls if call_latency >= self.slow_call_seconds)
+        if failures / total >= self.error_rate or slow_calls / total >= self.slow_call_rate:
+            logger.warning(f"Circuit breaker {self.name} tripping: {failures}/{total} failed, {slow_calls}/{total} slow")
+            self._transition(OPEN)
+
+# Adaptive concurrency limit (AIMD): grow while the backend keeps up, halve when it pushes back
+class AdaptiveConcurrencyLimiter:
+    def __init__(self, name, initial_limit=4, min_limit=1, max_limit=32, target_latency=45,
+                 backoff=0.5, max_queue=20):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        self._condition = None
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge(f"limiter.{self.name}.limit", round(self.limit, 2))
+        metrics.set_gauge(f"limiter.{self.name}.in_flight", self.in_flight)
+        metrics.set_gauge(f"limiter.{self.name}.waiting", self.waiting)
+
+    def _get_condition(self):
+        # Created lazily so the limiter can be built before the event loop exists
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _has_capacity(self):
+        return self.in_flight < int(self.limit)
+
+    # Returns False (load shed) when the wait queue is full or the wait times out
+    async def acquire(self, timeout=None):
+        if not self._has_capacity() and self.waiting >= self.max_queue:
+            metrics.inc(f"limiter.{self.name}.shed")
+            return False
+        condition = self._get_condition()
+        async with condition:
+            self.waiting += 1
+            self._publish()
+            try:
+                await asyncio.wait_for(condition.wait_for(self._has_capacity), timeout)
+            except asyncio.TimeoutError:
+                metrics.inc(f"limiter.{self.name}.shed")
+                return False
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self._publish()
+            return True
+
+    async def release(self, ok, latency):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight = max(0, self.in_flight - 1)
+            if ok and latency <= self.target_latency:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif not ok:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            else:
+                self.limit = max(self.min_limit, self.limit - 1 / self.limit)
+            self._publish()
+            condition.notify_all()
+
+    # Frees a slot whose request never reached the backend; tells us nothing about its capacity
+    async def release_unused(self):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._publish()
+            condition.notify_all()
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+
+from telegram import Update
+from telegram.ext import (
+    BaseUpdateProcessor, CallbackQueryHandler, ChatJoinRequestHandler, ChatMemberHandler,
+    ChosenInlineResultHandler, CommandHandler, InlineQueryHandler, MessageHandler,
+    PollAnswerHandler, PollHandler, PreCheckoutQueryHandler, ShippingQueryHandler
+)
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Processes updates concurrently up to a global cap while keeping updates
+# from the same chat strictly in arrival order
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates, max_pending_updates=10000):
+        # PTB's own semaphore only bounds pending updates; the real cap is
+        # applied after the per-chat lock so one busy chat can't hog all slots
+        super().__init__(max_pending_updates)
+        self.concurrency = max_concurrent_updates
+        self._slots = None
+        self._chat_locks = {}  # {chat_id: asyncio.Lock}
+        self._chat_depths = {}  # {chat_id: updates queued or running}
+        self._waiting = 0
+        self._running = 0
+
+    async def initialize(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self):
+        pass
+
+    def _publish(self):
+        metrics.set_gauge("dispatch.waiting", self._waiting)
+        metrics.set_gauge("dispatch.running", self._running)
+        metrics.set_gauge("dispatch.chats_queued", len(self._chat_depths))
+        metrics.set_gauge("dispatch.max_chat_depth", max(self._chat_depths.values(), default=0))
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await self._run(coroutine, time.monotonic())
+            return
+        chat_id = chat.id
+        lock = self._chat_locks.get(chat_id)
+        if lock is None:
+            lock = self._chat_locks[chat_id] = asyncio.Lock()
+        self._chat_depths[chat_id] = self._chat_depths.get(chat_id, 0) + 1
+        enqueued_at = time.monotonic()
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, which keeps the chat's updates ordered
+            async with lock:
+                await self._run(coroutine, enqueued_at)
+        finally:
+            depth = self._chat_depths[chat_id] - 1
+            if depth:
+                self._chat_depths[chat_id] = depth
+            else:
+                del self._chat_depths[chat_id]
+                del self._chat_locks[chat_id]
+            self._publish()
+
+    async def _run(self, coroutine, enqueued_at):
+        self._waiting += 1
+        self._publish()
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        metrics.observe("dispatch.wait_time", time.monotonic() - enqueued_at)
+        self._running += 1
+        self._publish()
+        try:
+            await coroutine
+        finally:
+            self._running -= 1
+            self._slots.release()
+
+    # Deepest per-chat queues, for the /metrics endpoint
+    def chat_depths(self, limit=10):
+        deepest = sorted(self._chat_depths.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return {str(chat_id): depth for chat_id, depth in deepest}
+
+# Update types each handler class consumes. Message-based handlers only get
+# new messages; edits and channel posts are not something this bot reacts to.
+HANDLER_UPDATE_TYPES = {
+    CommandHandler: (Update.MESSAGE,),
+    MessageHandler: (Update.MESSAGE,),
+    CallbackQueryHandler: (Update.CALLBACK_QUERY,),
+    InlineQueryHandler: (Update.INLINE_QUERY,),
+    ChosenInlineResultHandler: (Update.CHOSEN_INLINE_RESULT,),
+    PollHandler: (Update.POLL,),
+    PollAnswerHandler: (Update.POLL_ANSWER,),
+    ChatJoinRequestHandler: (Update.CHAT_JOIN_REQUEST,),
+    ShippingQueryHandler: (Update.SHIPPING_QUERY,),
+    PreCheckoutQueryHandler: (Update.PRE_CHECKOUT_QUERY,)
+}
+
+# Minimal allowed_updates for the handlers registered on the application
+def allowed_updates_for(application):
+    allowed = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ChatMemberHandler):
+                if handler.chat_member_types in (ChatMemberHandler.MY_CHAT_MEMBER, ChatMemberHandler.ANY_CHAT_MEMBER):
+                    allowed.add(Update.MY_CHAT_MEMBER)
+                if handler.chat_member_types in (ChatMemberHandler.CHAT_MEMBER, ChatMemberHandler.ANY_CHAT_MEMBER):
+                    allowed.add(Update.CHAT_MEMBER)
+                continue
+            for handler_type, update_types in HANDLER_UPDATE_TYPES.items():
+                if isinstance(handler, handler_type):
+                    allowed.update(update_types)
+                    break
+            else:
+                # Unknown handler type: don't guess, subscribe to everything
+                logger.warning(f"Can't derive update types for {type(handler).__name__}, allowing all updates")
+                return list(Update.ALL_TYPES)
+    return sorted(allowed)
+
+# Cheap check on the raw webhook payload, before Update.de_json builds the object tree
+def is_allowed_update(data, allowed_updates):
+    if not isinstance(data, dict) or "update_id" not in data:
+        return False
+    for key in data:
+        if key in allowed_updates:
+            return True
+    return False
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FIELDS = (
+    'chat_id', 'chat_type', 'user_id', 'prompt', 'description', 'scene', 'color', 'custom_text',
+    'object', 'characters', 'ticker', 'image_url', 'image_digest', 'file_id', 'created_at'
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    chat_type TEXT,
+    user_id INTEGER,
+    prompt TEXT NOT NULL,
+    description TEXT,
+    scene TEXT,
+    color TEXT,
+    custom_text TEXT,
+    object TEXT,
+    characters TEXT,
+    ticker TEXT,
+    image_url TEXT,
+    image_digest TEXT,
+    file_id TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS memes_chat ON memes (chat_id, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS memes_fts USING fts5(
+    prompt, custom_text, content='memes', content_rowid='id', prefix='2 3 4'
+);
+CREATE TRIGGER IF NOT EXISTS memes_fts_insert AFTER INSERT ON memes BEGIN
+    INSERT INTO memes_fts (rowid, prompt, custom_text) VALUES (new.id, new.prompt, new.custom_text);
+END;
+CREATE TRIGGER IF NOT EXISTS memes_fts_delete AFTER DELETE ON memes BEGIN
+    INSERT INTO memes_fts (memes_fts, rowid, prompt, custom_text) VALUES ('delete', old.id, old.prompt, old.custom_text);
+END;
+"""
+
+INSERT_SQL = f"INSERT INTO memes ({', '.join(FIELDS)}) VALUES ({', '.join('?' for _ in FIELDS)})"
+WORD_PATTERN = re.compile(r"\w+")
+
+# User text as an FTS5 query: every word must match, as a prefix; None for no words.
+# Words are quoted so FTS5 operators and syntax in the input are never interpreted.
+# Single letters match whole words only, as they are too short for the prefix index.
+def match_expression(text):
+    words = WORD_PATTERN.findall((text or "").lower())
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' if len(word) > 1 else f'"{word}"' for word in words)
+
+# Every delivered meme with its prompt and parsed fields, full-text searchable by prompt.
+# Inserts are queued in memory and written in batches by a background task, so recording a
+# meme never waits on SQLite. Pages are keyset-paginated on the row ID (newest first): a
+# cursor is the last ID seen, and deep pages cost the same as the first.
+class GalleryStore:
+    def __init__(self, path, batch_size=100, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._pending = []  # rows waiting for the next batch
+        self._wake = None
+        self._task = None
+
+    def record(self, chat_id, prompt, **fields):
+        fields.update(chat_id=chat_id, prompt=prompt)
+        fields.setdefault('created_at', time.time())
+        self._pending.append(tuple(fields.get(name) for name in FIELDS))
+        metrics.set_gauge("gallery.pending", len(self._pending))
+        if len(self._pending) >= self.batch_size and self._wake is not None:
+            self._wake.set()
+
+    def _insert(self, rows):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(INSERT_SQL, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def flush(self):
+        rows, self._pending = self._pending, []
+        if not rows:
+            return
+        start_time = time.monotonic()
+        try:
+            await asyncio.to_thread(self._insert, rows)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to write {len(rows)} gallery rows: {str(e)}")
+            metrics.inc("gallery.write_failed")
+            return
+        metrics.observe("gallery.flush_latency", time.monotonic() - start_time)
+        metrics.inc("gallery.recorded", len(rows))
+        metrics.set_gauge("gallery.pending", len(self._pending))
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Gallery writer failed: {str(e)}")
+
+    def _search(self, text, chat_id, before, limit, include_private):
+        expression = match_expression(text)
+        conditions, params = [], []
+        if expression is not None:
+            sql = "SELECT m.* FROM memes_fts JOIN memes m ON m.id = memes_fts.rowid WHERE memes_fts MATCH ?"
+            params.append(expression)
+            id_column = "memes_fts.rowid"
+        else:
+            sql = "SELECT m.* FROM memes m WHERE 1"
+            id_column = "m.id"
+        if chat_id is not None:
+            conditions.append("m.chat_id = ?")
+            params.append(chat_id)
+        if not include_private:
+            conditions.append("m.chat_type IS NOT 'private'")
+        if before is not None:
+            conditions.append(f"{id_column} < ?")
+            params.append(before)
+        for condition in conditions:
+            sql += f" AND {condition}"
+        sql += f" ORDER BY {id_column} DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            rows = [dict(row) for row in self._conn.execute(sql, params)]
+        next_cursor = rows[limit - 1]['id'] if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    # One page of memes, newest first, and the cursor for the next page (None on the last)
+    async def search(self, text="", chat_id=None, before=None, limit=20, include_private=True):
+        start_time = time.monotonic()
+        result = await asyncio.to_thread(self._search, text, chat_id, before, limit, include_private)
+        metrics.observe("gallery.search_latency", time.monotonic() - start_time)
+        return result
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        with self._lock:
+            self._conn.close()
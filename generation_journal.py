@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ACCEPTED = "accepted"
+SUBMITTED = "submitted"
+DELIVERED = "delivered"
+FAILED = "failed"
+EXPIRED = "expired"
+CANCELLED = "cancelled"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER,
+    reply_to_message_id INTEGER,
+    prompt TEXT NOT NULL,
+    caption TEXT,
+    custom_text TEXT,
+    ticker TEXT,
+    profile TEXT,
+    backend TEXT,
+    prediction_id TEXT,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+
+# Durable record of accepted generation jobs, so predictions that outlive the
+# process (deploys, restarts) are picked up and delivered by the next one
+class GenerationJournal:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self.submitted = set()  # prediction IDs journaled as submitted by this process
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    # SQLite calls run in a worker thread so fsyncs never stall the event loop
+    async def _run(self, sql, params=()):
+        return await asyncio.to_thread(self._execute, sql, params)
+
+    # custom_text and ticker are set when the text is drawn locally after generation
+    async def accept(self, chat_id, user_id, reply_to_message_id, prompt, caption, profile=None, custom_text=None, ticker=None):
+        now = time.time()
+        cursor = await self._run(
+            "INSERT INTO jobs (chat_id, user_id, reply_to_message_id, prompt, caption, custom_text, ticker, profile, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (chat_id, user_id, reply_to_message_id, prompt, caption, custom_text, ticker, profile, ACCEPTED, now, now)
+        )
+        metrics.inc("journal.accepted")
+        return cursor.lastrowid
+
+    async def set_prediction(self, job_id, backend, prediction_id):
+        self.submitted.add(prediction_id)
+        await self._run(
+            "UPDATE jobs SET backend = ?, prediction_id = ?, status = ?, updated_at = ? WHERE id = ?",
+            (backend, prediction_id, SUBMITTED, time.time(), job_id)
+        )
+
+    async def finish(self, job_id, status):
+        cursor = await self._run("SELECT prediction_id FROM jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        if row is not None:
+            self.submitted.discard(row['prediction_id'])
+        await self._run("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), job_id))
+        metrics.inc(f"journal.{status}")
+
+    async def unfinished(self):
+        cursor = await self._run(
+            "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY id", (ACCEPTED, SUBMITTED)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+    # Finished jobs are only kept for a while
+    async def prune(self, older_than):
+        await self._run(
+            "DELETE FROM jobs WHERE status NOT IN (?, ?) AND updated_at < ?",
+            (ACCEPTED, SUBMITTED, time.time() - older_than)
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
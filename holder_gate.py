@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import secrets
+import time
+
+import metrics
+from sui_rpc import SuiRpcError
+
+logger = logging.getLogger(__name__)
+
+SUI_ADDRESS_PATTERN = re.compile(r"^0x[0-9a-fA-F]{64}$")
+
+# Holder states returned by HolderGate.status
+HOLDER_OK = "ok"
+HOLDER_INSUFFICIENT = "insufficient"
+HOLDER_UNLINKED = "unlinked"
+HOLDER_UNKNOWN = "unknown"  # linked but not verified yet (or the result expired)
+
+SUI_COIN_TYPE = "0x2::sui::SUI"
+MIST_PER_SUI = 10 ** 9
+
+# Lets users into gated groups when their linked Sui address holds enough of the group's coin.
+# Balances are cached per (user, coin); join events and stale entries are re-verified in the
+# background in batches, so commands only read the cache. Linking needs proof of ownership:
+# the user sends a random dust amount of SUI from the address, which only its owner can do.
+class HolderGate:
+    def __init__(self, rpc, path="linked_addresses.json", ttl=3600, recheck_interval=60, batch_size=50,
+                 challenge_ttl=1800):
+        self.rpc = rpc
+        self.path = path
+        self.challenge_ttl = challenge_ttl  # seconds a link challenge stays open
+        self.ttl = ttl  # seconds a verified balance stays valid
+        self.recheck_interval = recheck_interval
+        self.batch_size = batch_size
+        self.addresses = {}  # {user_id: address}
+        self.owners = {}  # {address: user_id}, one Telegram user per address
+        self.balances = {}  # {(user_id, coin_type): (whole-token balance, checked_at)}
+        self.watched = {}  # {(user_id, coin_type): last_seen}, pairs kept fresh in the background
+        self.pending = set()  # {(user_id, coin_type)} to verify on the next pass
+        self.challenges = {}  # {user_id: (address, amount in MIST, issued_at)}
+        self._save_lock = None
+        self._task = None
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        self.addresses = {int(user_id): address for user_id, address in data.items()}
+        self.owners = {address: user_id for user_id, address in self.addresses.items()}
+        logger.info(f"Loaded {len(self.addresses)} linked addresses")
+
+    def _write(self, data):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    async def _save(self):
+        if self._save_lock is None:
+            self._save_lock = asyncio.Lock()
+        async with self._save_lock:
+            data = {str(user_id): address for user_id, address in self.addresses.items()}
+            await asyncio.to_thread(self._write, data)
+
+    def _check_address(self, user_id, address):
+        if not SUI_ADDRESS_PATTERN.match(address):
+            return "That doesn't look like a Sui address (0x followed by 64 hex characters)"
+        owner = self.owners.get(address.lower())
+        if owner is not None and owner != user_id:
+            return "That address is already linked to another account"
+        return None
+
+    # Starts linking address to user_id. Returns (error message, None) or (None, MIST amount
+    # the user must send from the address to any other address before calling confirm).
+    def challenge(self, user_id, address):
+        error = self._check_address(user_id, address)
+        if error:
+            return error, None
+        now = time.time()
+        for stale in [key for key, (_, _, issued_at) in self.challenges.items() if now - issued_at > self.challenge_ttl]:
+            del self.challenges[stale]
+        amount = 1000 + secrets.randbelow(999000)  # 0.000001-0.001 SUI, random so it can't be guessed
+        self.challenges[user_id] = (address.lower(), amount, now)
+        metrics.inc("holder_gate.challenged")
+        return None, amount
+
+    # The open challenge as (address, amount in MIST), or None
+    def pending_challenge(self, user_id):
+        challenge = self.challenges.get(user_id)
+        if challenge is None:
+            return None
+        if time.time() - challenge[2] > self.challenge_ttl:
+            del self.challenges[user_id]
+            return None
+        return challenge[0], challenge[1]
+
+    # Whether a transaction sent by address since issued_at moved exactly amount MIST to someone else
+    def _proves(self, transaction, address, amount, issued_at):
+        try:
+            if int(transaction["timestampMs"]) < issued_at * 1000:
+                return False
+            for change in transaction.get("balanceChanges") or ():
+                owner = change["owner"]
+                recipient = owner.get("AddressOwner") if isinstance(owner, dict) else None
+                if (recipient is not None and recipient.lower() != address
+                        and change["coinType"] == SUI_COIN_TYPE and int(change["amount"]) == amount):
+                    return True
+        except (KeyError, TypeError, ValueError, AttributeError):
+            pass
+        return False
+
+    # Finishes the open challenge: links the address once the dust transfer is on chain.
+    # Returns an error message, or None when linked.
+    async def confirm(self, user_id):
+        if self.pending_challenge(user_id) is None:
+            return "No link in progress (or it expired). Start again with /link <address>"
+        address, amount, issued_at = self.challenges[user_id]
+        transactions = await self.rpc.get_transactions_from(address)
+        if not any(self._proves(transaction, address, amount, issued_at) for transaction in transactions):
+            return "No matching transfer from that address yet. It can take a few seconds to show up"
+        error = self._check_address(user_id, address)
+        if error:
+            return error
+        self.challenges.pop(user_id, None)
+        await self._link(user_id, address)
+        return None
+
+    async def _link(self, user_id, address):
+        previous = self.addresses.get(user_id)
+        if previous is not None:
+            self.owners.pop(previous, None)
+        self.addresses[user_id] = address
+        self.owners[address] = user_id
+        for key in [key for key in self.balances if key[0] == user_id]:
+            del self.balances[key]
+        await self._save()
+        metrics.inc("holder_gate.linked")
+
+    # Cache-only check, no network
+    def status(self, user_id, coin_type, min_balance):
+        if user_id not in self.addresses:
+            return HOLDER_UNLINKED
+        self.watched[(user_id, coin_type)] = time.time()
+        entry = self.balances.get((user_id, coin_type))
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return HOLDER_UNKNOWN
+        return HOLDER_OK if entry[0] >= min_balance else HOLDER_INSUFFICIENT
+
+    # Join events: verify in the background so the user's first command finds a cached result
+    def enqueue(self, user_id, coin_type):
+        if user_id in self.addresses:
+            self.watched[(user_id, coin_type)] = time.time()
+            self.pending.add((user_id, coin_type))
+
+    async def verify(self, user_id, coin_type):
+        address = self.addresses.get(user_id)
+        if address is None:
+            return None
+        metadata = await self.rpc.get_coin_metadata(coin_type)
+        balance = await self.rpc.get_balance(address, coin_type, ttl=0)
+        decimals = (metadata or {}).get("decimals", 0)
+        if not isinstance(balance, dict) or "totalBalance" not in balance:
+            raise SuiRpcError(f"No balance for {address} on {coin_type}")
+        amount = int(balance["totalBalance"]) / 10 ** decimals
+        self.balances[(user_id, coin_type)] = (amount, time.time())
+        metrics.inc("holder_gate.verified")
+        return amount
+
+    # Verify many pairs; concurrent calls are sent upstream as JSON-RPC batches
+    async def verify_many(self, pairs):
+        pairs = list(pairs)
+        for start in range(0, len(pairs), self.batch_size):
+            chunk = pairs[start:start + self.batch_size]
+            results = await asyncio.gather(*(self.verify(*pair) for pair in chunk), return_exceptions=True)
+            for pair, result in zip(chunk, results):
+                # One bad pair (or odd node reply) must not abort the rest of the sweep
+                if isinstance(result, Exception):
+                    logger.warning(f"Balance check for user {pair[0]} on {pair[1]} failed: {str(result)}")
+                    metrics.inc("holder_gate.verify_failed")
+
+    # Watched pairs that are due: unverified, or past half their TTL (refreshed before they expire)
+    def _due(self, now):
+        for key, last_seen in list(self.watched.items()):
+            if now - last_seen > 24 * 3600:
+                # Not seen in a gated chat for a day; stop refreshing
+                del self.watched[key]
+                continue
+            entry = self.balances.get(key)
+            if entry is None or now - entry[1] > self.ttl / 2:
+                yield key
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        last_recheck = 0
+        while True:
+            await asyncio.sleep(2)
+            try:
+                pairs, self.pending = self.pending, set()
+                now = time.time()
+                if now - last_recheck >= self.recheck_interval:
+                    last_recheck = now
+                    pairs.update(self._due(now))
+                if pairs:
+                    await self.verify_many(pairs)
+                metrics.set_gauge("holder_gate.watched", len(self.watched))
+            except Exception as e:
+                logger.error(f"Holder re-verification failed: {str(e)}")
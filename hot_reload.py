@@ -0,0 +1,87 @@
+import asyncio
+import json
+import logging
+import os
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# JSON data files compiled into an immutable snapshot. Files are polled by mtime and size;
+# on change they are parsed and validated in a worker thread and the snapshot is swapped
+# in with a single assignment. A malformed edit keeps the last good snapshot.
+class ReloadableData:
+    def __init__(self, name, paths, build, interval=2.0, on_reload=None):
+        self.name = name
+        self.paths = tuple(paths)
+        self.build = build  # ({path: parsed JSON, None when missing}) -> snapshot, raises ValueError
+        self.interval = interval
+        self.on_reload = on_reload  # called with the new snapshot after a swap
+        self.current = None
+        self._stamps = None
+        self._task = None
+
+    def _stamp(self):
+        stamps = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                stamps.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def _compile(self):
+        data = {}
+        for path in self.paths:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data[path] = json.load(f)
+            except FileNotFoundError:
+                data[path] = None
+        return self.build(data)
+
+    # Blocking first load at startup; raises ValueError (or OSError) when the files are unusable
+    def load(self):
+        self._stamps = self._stamp()
+        self.current = self._compile()
+        logger.info(f"Loaded {self.name} from {', '.join(self.paths)}")
+        return self.current
+
+    async def check(self):
+        stamps = await asyncio.to_thread(self._stamp)
+        if stamps == self._stamps:
+            return False
+        self._stamps = stamps
+        try:
+            snapshot = await asyncio.to_thread(self._compile)
+        except (OSError, ValueError) as e:
+            logger.error(f"Reload of {self.name} failed, keeping the previous version: {str(e)}")
+            metrics.inc(f"reload.{self.name}.failed")
+            return False
+        self.current = snapshot
+        metrics.inc(f"reload.{self.name}.ok")
+        logger.info(f"Reloaded {self.name}")
+        if self.on_reload is not None:
+            self.on_reload(snapshot)
+        return True
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Reload watcher for {self.name} failed: {str(e)}")
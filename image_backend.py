@@ -0,0 +1,442 @@
+import asyncio
+import hashlib
+import logging
+import random
+import re
+import time
+
+import httpx
+
+import metrics
+from circuit_breaker import CircuitBreaker, AdaptiveConcurrencyLimiter
+
+logger = logging.getLogger(__name__)
+
+REPLICATE_PREDICTIONS_URL = "https://api.replicate.com/v1/predictions"
+PREDICTION_REPLACED = "Replaced by a newer request"
+SDXL_VERSION = "stability-ai/sdxl:39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b"
+# Diffusers progress bars in prediction logs, e.g. " 45%|████▌     | 23/50 [00:05<00:05]"
+LOG_PERCENT_PATTERN = re.compile(r"(\d{1,3})%\|")
+
+# Raised by backends; healthy=True means the backend answered and the failure is about the request itself
+class BackendError(Exception):
+    def __init__(self, message, healthy=False, prediction=None, timed_out=False):
+        super().__init__(message)
+        self.healthy = healthy
+        self.prediction = prediction
+        self.timed_out = timed_out
+
+# One submitted generation on some backend
+class Prediction:
+    def __init__(self, backend, prediction_id, prompt):
+        self.backend = backend
+        self.id = prediction_id
+        self.prompt = prompt
+        self.status = "starting"
+        self.output = None
+        self.error = None
+        self.owner = None
+        self.cancel_reason = None
+        self.reported = None  # last (stage, percent) passed to on_progress
+        self.created_at = time.monotonic()
+
+    # Calls on_progress(stage, percent) only when the stage or percentage changed
+    async def report(self, on_progress, stage, percent=None):
+        if on_progress is None or (stage, percent) == self.reported:
+            return
+        self.reported = (stage, percent)
+        await on_progress(stage, percent)
+
+# Interface every image provider implements
+class ImageBackend:
+    name = "base"
+    cost_per_image = 0.0  # rough USD per image, used by the router
+    on_demand = False  # only used when a request prefers it by name
+
+    async def submit(self, prompt, **options):
+        raise NotImplementedError
+
+    # Returns the image URL once the prediction succeeds, raises BackendError otherwise;
+    # on_progress(stage, percent) is awaited as the prediction starts and advances
+    async def wait(self, prediction, timeout, on_progress=None):
+        raise NotImplementedError
+
+    async def cancel(self, prediction):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+# Replicate predictions API, one instance per model version
+class ReplicateBackend(ImageBackend):
+    def __init__(self, api_token, version=SDXL_VERSION, name="replicate-sdxl", cost_per_image=0.01,
+                 poll_interval=1, extra_input=None, on_demand=False):
+        self.api_token = api_token
+        self.on_demand = on_demand
+        self.version = version
+        self.name = name
+        self.cost_per_image = cost_per_image
+        self.poll_interval = poll_interval
+        self.extra_input = extra_input or {}
+        self._client = None
+
+    def _get_client(self):
+        # One pooled client per backend instead of a new connection per request
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=60.0,
+                headers={
+                    "Authorization": f"Token {self.api_token}",
+                    "Content-Type": "application/json"
+                }
+            )
+        return self._client
+
+    async def submit(self, prompt, **options):
+        data = {
+            "version": self.version,
+            "input": {"prompt": prompt, **self.extra_input, **options}
+        }
+        logger.info(f"Sending request to Replicate ({self.name}) with prompt: {prompt}")
+        try:
+            response = await self._get_client().post(REPLICATE_PREDICTIONS_URL, json=data)
+        except httpx.TimeoutException as e:
+            raise BackendError(f"Replicate API timeout: {str(e)}")
+        except httpx.HTTPError as e:
+            raise BackendError(f"Replicate API connection error: {str(e)}")
+        if response.status_code == 429:
+            logger.error("Replicate API rate limit exceeded")
+            raise BackendError("Rate limit exceeded, please try again later")
+        if response.status_code != 201:
+            logger.error(f"Replicate API error: {response.status_code} - {response.text}")
+            raise BackendError(
+                f"Replicate API error: {response.status_code} - {response.text}",
+                healthy=response.status_code < 500
+            )
+        try:
+            prediction_id = response.json().get("id")
+        except ValueError:
+            raise BackendError("Replicate API returned invalid JSON")
+        if not prediction_id:
+            logger.error("No prediction ID in response")
+            raise BackendError("Failed to get prediction ID")
+        logger.info(f"Prediction ID: {prediction_id}")
+        return Prediction(self, prediction_id, prompt)
+
+    async def wait(self, prediction, timeout, on_progress=None):
+        client = self._get_client()
+        start_time = time.monotonic()
+        while time.monotonic() - start_time < timeout:
+            try:
+                status_response = await client.get(f"{REPLICATE_PREDICTIONS_URL}/{prediction.id}")
+            except httpx.HTTPError as e:
+                raise BackendError(f"Status check error: {str(e)}", prediction=prediction)
+            if status_response.status_code != 200:
+                logger.error(f"Status check error: {status_response.status_code} - {status_response.text}")
+                raise BackendError(f"Status check error: {status_response.status_code}", prediction=prediction)
+            try:
+                result = status_response.json()
+                prediction.status = result["status"]
+            except (ValueError, KeyError):
+                raise BackendError("Status check returned an invalid response", prediction=prediction)
+            if prediction.status in ["succeeded", "failed", "canceled"]:
+                break
+            percents = LOG_PERCENT_PATTERN.findall(result.get("logs") or "")
+            await prediction.report(on_progress, prediction.status, int(percents[-1]) if percents else None)
+            await asyncio.sleep(self.poll_interval)
+        else:
+            logger.error("Replicate API took too long to respond")
+            raise BackendError("Image generation timed out", prediction=prediction, timed_out=True)
+
+        if prediction.status == "succeeded" and result.get("output"):
+            output = result["output"]
+            prediction.output = output[0] if isinstance(output, list) else output
+            logger.info("Image generation succeeded")
+            return prediction.output
+        prediction.error = result.get('error', 'Unknown error')
+        logger.error(f"Image generation failed: {prediction.error}")
+        raise BackendError(f"Image generation failed: {prediction.error}", healthy=True, prediction=prediction)
+
+    async def cancel(self, prediction):
+        try:
+            response = await self._get_client().post(f"{REPLICATE_PREDICTIONS_URL}/{prediction.id}/cancel")
+            if response.status_code != 200:
+                logger.warning(f"Cancel of prediction {prediction.id} returned {response.status_code}")
+                return False
+            prediction.status = "canceled"
+            return True
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to cancel prediction {prediction.id}: {str(e)}")
+            return False
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+# Deterministic offline backend for tests and benchmarks: same prompt, same URL
+class LocalStubBackend(ImageBackend):
+    def __init__(self, name="stub", latency=0.0, failure_rate=0.0, cost_per_image=0.0, seed=0):
+        self.name = name
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.cost_per_image = cost_per_image
+        self._random = random.Random(seed)
+        self._counter = 0
+
+    async def submit(self, prompt, **options):
+        self._counter += 1
+        return Prediction(self, f"stub-{self._counter}", prompt)
+
+    async def wait(self, prediction, timeout, on_progress=None):
+        if self.latency > timeout:
+            await asyncio.sleep(timeout)
+            raise BackendError("Image generation timed out", prediction=prediction, timed_out=True)
+        await prediction.report(on_progress, "processing", 0)
+        await asyncio.sleep(self.latency / 2)
+        await prediction.report(on_progress, "processing", 50)
+        await asyncio.sleep(self.latency / 2)
+        if prediction.status == "canceled":
+            raise BackendError("Image generation failed: canceled", healthy=True, prediction=prediction)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            prediction.status = "failed"
+            raise BackendError("Stub backend failure", prediction=prediction)
+        digest = hashlib.sha256(prediction.prompt.encode("utf-8")).hexdigest()[:32]
+        prediction.status = "succeeded"
+        prediction.output = f"https://example.com/stub/{digest}.png"
+        return prediction.output
+
+    async def cancel(self, prediction):
+        prediction.status = "canceled"
+        return True
+
+# In-flight predictions, so abandoned ones get cancelled instead of running (and billing) to completion
+class PredictionRegistry:
+    def __init__(self):
+        self.in_flight = {}  # {prediction_id: Prediction}
+        self.by_owner = {}  # {owner: prediction_id}
+
+    def track(self, prediction, owner=None):
+        prediction.owner = owner
+        self.in_flight[prediction.id] = prediction
+        if owner is not None:
+            self.by_owner[owner] = prediction.id
+        metrics.set_gauge("predictions.in_flight", len(self.in_flight))
+
+    def finish(self, prediction):
+        self.in_flight.pop(prediction.id, None)
+        if prediction.owner is not None and self.by_owner.get(prediction.owner) == prediction.id:
+            del self.by_owner[prediction.owner]
+        metrics.set_gauge("predictions.in_flight", len(self.in_flight))
+
+    def has_owner(self, owner):
+        return owner in self.by_owner
+
+    async def cancel(self, prediction, reason):
+        if prediction.cancel_reason is not None:
+            return False
+        prediction.cancel_reason = reason
+        wasted = time.monotonic() - prediction.created_at
+        cancelled = await prediction.backend.cancel(prediction)
+        logger.info(f"Cancelled prediction {prediction.id} on {prediction.backend.name} ({reason}), {wasted:.1f}s wasted")
+        metrics.inc(f"predictions.cancelled.{reason}")
+        metrics.inc("predictions.wasted_gpu_seconds", round(wasted, 3))
+        if not cancelled:
+            metrics.inc("predictions.cancel_failed")
+        self.finish(prediction)
+        return cancelled
+
+    # A new request from the same owner supersedes the old prediction
+    async def replace(self, owner):
+        prediction_id = self.by_owner.get(owner)
+        prediction = self.in_flight.get(prediction_id)
+        if prediction is None:
+            return False
+        return await self.cancel(prediction, "replaced")
+
+    # keep: prediction IDs that someone else (e.g. the generation journal) will pick up later
+    async def cancel_all(self, reason="shutdown", keep=()):
+        for prediction in list(self.in_flight.values()):
+            if prediction.id in keep:
+                continue
+            await self.cancel(prediction, reason)
+
+# Per-backend routing state: breaker, concurrency limit and observed latency
+class BackendRoute:
+    def __init__(self, backend, breaker, limiter):
+        self.backend = backend
+        self.breaker = breaker
+        self.limiter = limiter
+        self.latency_ewma = None
+
+    def observe_latency(self, latency, alpha=0.2):
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = alpha * latency + (1 - alpha) * self.latency_ewma
+        metrics.set_gauge(f"backend.{self.backend.name}.latency_ewma", round(self.latency_ewma, 3))
+
+# Fails over (in priority order) or load-balances across image backends
+class BackendRouter:
+    def __init__(self, backends, strategy="failover", queue_timeout=30, wait_timeout=120,
+                 cost_weight=100, breaker_options=None, limiter_options=None):
+        self.strategy = strategy
+        self.queue_timeout = queue_timeout
+        self.wait_timeout = wait_timeout
+        self.cost_weight = cost_weight  # seconds of latency one dollar per image is worth
+        self.registry = PredictionRegistry()
+        self.routes = [
+            BackendRoute(
+                backend,
+                CircuitBreaker(backend.name, **(breaker_options or {})),
+                AdaptiveConcurrencyLimiter(backend.name, **(limiter_options or {}))
+            )
+            for backend in backends
+        ]
+
+    def is_open(self):
+        return all(route.breaker.is_open() for route in self.routes)
+
+    def retry_after(self):
+        return min((route.breaker.retry_after() for route in self.routes), default=0)
+
+    def _score(self, route):
+        # Unmeasured backends get the wait timeout as latency so measured ones are preferred
+        latency = route.latency_ewma if route.latency_ewma is not None else self.wait_timeout / 4
+        return latency + self.cost_weight * route.backend.cost_per_image
+
+    def _ranked(self):
+        routes = [route for route in self.routes if not route.backend.on_demand]
+        if self.strategy != "balance" or len(routes) < 2:
+            return routes
+        # Power of two choices: pick the better of two random routes, fall back to the rest by score
+        first, second = random.sample(routes, 2)
+        best = first if self._score(first) <= self._score(second) else second
+        rest = sorted((route for route in routes if route is not best), key=self._score)
+        return [best] + rest
+
+    # Nothing in flight and nobody queued for a slot
+    def is_idle(self):
+        return not self.registry.in_flight and not any(route.limiter.waiting for route in self.routes)
+
+    # Requests running or waiting for a slot, across all backends
+    def queue_depth(self):
+        return sum(route.limiter.in_flight + route.limiter.waiting for route in self.routes)
+
+    # Observed latency of the first (primary) backend that has measurements
+    def primary_latency(self):
+        for route in self.routes:
+            if route.latency_ewma is not None:
+                return route.latency_ewma
+        return None
+
+    def route_for(self, backend_name):
+        for route in self.routes:
+            if route.backend.name == backend_name:
+                return route
+        return None
+
+    # owner identifies who asked (e.g. chat and user) so a newer request can replace this one;
+    # on_submit is awaited with the Prediction as soon as the backend accepts it;
+    # on_progress(stage, percent) gets "queued" (percent is then the queue position),
+    # "starting" and "processing" events;
+    # prefer names a backend to try first (e.g. a distilled model under load)
+    async def generate(self, prompt, owner=None, on_submit=None, on_progress=None, prefer=None, **options):
+        last_error = None
+        routes = self._ranked()
+        preferred = self.route_for(prefer) if prefer else None
+        if preferred is not None:
+            routes = [preferred] + [route for route in routes if route is not preferred]
+        for route in routes:
+            name = route.backend.name
+            if route.breaker.is_open():
+                metrics.inc(f"backend.{name}.rejected_open")
+                continue
+            if on_progress is not None and route.limiter.in_flight >= int(route.limiter.limit):
+                await on_progress("queued", route.limiter.waiting + 1)
+            if not await route.limiter.acquire(timeout=self.queue_timeout):
+                logger.warning(f"Backend {name} concurrency limit reached, shedding request")
+                metrics.inc(f"backend.{name}.shed")
+                last_error = "Too many memes cooking right now, try again in a bit"
+                continue
+            if not route.breaker.allow_request():
+                # Breaker tripped while we were queued; nothing reached upstream
+                await route.limiter.release_unused()
+                continue
+            start_time = time.monotonic()
+            healthy = False
+            accounted = True  # whether this attempt counts toward the breaker and latency stats
+            prediction = None
+            try:
+                prediction = await route.backend.submit(prompt, **options)
+                self.registry.track(prediction, owner)
+                if on_submit is not None:
+                    await on_submit(prediction)
+                await prediction.report(on_progress, "starting")
+                image_url = await route.backend.wait(prediction, self.wait_timeout, on_progress)
+                healthy = True
+                return image_url, None
+            except BackendError as e:
+                healthy = e.healthy
+                last_error = str(e)
+                if prediction is not None and prediction.cancel_reason is not None:
+                    # We cancelled it ourselves: it never finished, so it says nothing about
+                    # the backend's health, latency or capacity
+                    accounted = False
+                    return None, PREDICTION_REPLACED if prediction.cancel_reason == "replaced" else last_error
+                if e.timed_out and prediction is not None:
+                    await self.registry.cancel(prediction, "timeout")
+                if healthy:
+                    # The backend works, the request itself failed; another provider won't help
+                    return None, last_error
+                logger.warning(f"Backend {name} failed: {last_error}")
+            except Exception:
+                # Our own bookkeeping (journal, progress callbacks) failed, not the backend: keep it
+                # out of the breaker, and don't leave a prediction running that nobody will collect
+                accounted = False
+                if prediction is not None:
+                    await self.registry.cancel(prediction, "error")
+                raise
+            finally:
+                if prediction is not None:
+                    self.registry.finish(prediction)
+                latency = time.monotonic() - start_time
+                if not accounted:
+                    route.breaker.release_unused()
+                    await route.limiter.release_unused()
+                else:
+                    metrics.observe(f"backend.{name}.latency", latency)
+                    metrics.inc(f"backend.{name}.requests")
+                    if healthy:
+                        route.observe_latency(latency)
+                        route.breaker.record_success(latency)
+                    else:
+                        metrics.inc(f"backend.{name}.failures")
+                        route.breaker.record_failure(latency)
+                    await route.limiter.release(healthy, latency)
+        if last_error is None:
+            retry_after = self.retry_after()
+            logger.warning(f"All image backends open, failing fast (retry in {retry_after:.0f}s)")
+            last_error = f"The meme machine is cooling down, try again in {max(1, int(retry_after))}s"
+        return None, last_error
+
+    # Pick up waiting on a prediction submitted earlier (e.g. by a previous process)
+    async def resume(self, backend_name, prediction_id, prompt, owner=None):
+        route = self.route_for(backend_name)
+        if route is None:
+            return None, f"Unknown backend {backend_name}"
+        prediction = Prediction(route.backend, prediction_id, prompt)
+        self.registry.track(prediction, owner)
+        try:
+            return await route.backend.wait(prediction, self.wait_timeout), None
+        except BackendError as e:
+            if e.timed_out:
+                await self.registry.cancel(prediction, "timeout")
+            return None, str(e)
+        finally:
+            self.registry.finish(prediction)
+
+    async def close(self, keep=()):
+        await self.registry.cancel_all("shutdown", keep)
+        for route in self.routes:
+            await route.backend.close()
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Magic bytes -> (file extension, media type)
+IMAGE_TYPES = (
+    (b"\xff\xd8\xff", ".jpg", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", ".png", "image/png"),
+    (b"GIF8", ".gif", "image/gif"),
+    (b"RIFF", ".webp", "image/webp"),
+)
+MEDIA_TYPES = {extension: media_type for _, extension, media_type in IMAGE_TYPES}
+
+def sniff_extension(head):
+    for magic, extension, _ in IMAGE_TYPES:
+        # RIFF is a container (WAV, AVI too); WebP has its form type at bytes 8-12
+        if head.startswith(magic) and (magic != b"RIFF" or head[8:12] == b"WEBP"):
+            return extension
+    raise ValueError("Not a JPEG, PNG, GIF or WebP image")
+
+# Images on disk named by the SHA-256 of their bytes, sharded as ab/cd/abcd....jpg so no
+# directory grows huge. Writes go to a temp file that is renamed into place, so readers never
+# see a partial image and storing the same image twice is free. Total size is capped: the
+# least recently used images are deleted once the cap is exceeded.
+class ImageStore:
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, max_image_bytes=10 * 1024 * 1024, touch_interval=600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_image_bytes = max_image_bytes
+        self.touch_interval = touch_interval  # min seconds between mtime bumps of a served file
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.entries = OrderedDict()  # {digest: [extension, size, last touched]}, least recently used first
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+
+    def path_for(self, digest, extension):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest + extension)
+
+    # Index what is already on disk, least recently used (oldest mtime) first
+    def load(self):
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        for name in os.listdir(self.tmp_dir):
+            # Leftovers from writes interrupted by a crash
+            os.unlink(os.path.join(self.tmp_dir, name))
+        found = []
+        for directory, _, names in os.walk(self.root):
+            if directory == self.tmp_dir:
+                continue
+            for name in names:
+                digest, extension = os.path.splitext(name)
+                if DIGEST_PATTERN.match(digest) and extension in MEDIA_TYPES:
+                    stat = os.stat(os.path.join(directory, name))
+                    found.append((stat.st_mtime, digest, extension, stat.st_size))
+        found.sort()
+        with self._lock:
+            self.entries = OrderedDict((digest, [extension, size, mtime]) for mtime, digest, extension, size in found)
+            self.total_bytes = sum(size for _, _, _, size in found)
+        metrics.set_gauge("image_store.bytes", self.total_bytes)
+        logger.info(f"Image store has {len(found)} images, {self.total_bytes / 1024 ** 2:.1f} MiB")
+
+    # (path, media type) of a stored image, marking it recently used; None when not stored
+    def lookup(self, digest):
+        with self._lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                return None
+            self.entries.move_to_end(digest)
+            extension = entry[0]
+            now = time.time()
+            touch = now - entry[2] > self.touch_interval
+            if touch:
+                entry[2] = now
+        path = self.path_for(digest, extension)
+        if touch:
+            # Keeps the LRU order across restarts; throttled so hot images don't cost a syscall each
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+        return path, MEDIA_TYPES[extension]
+
+    def _tmp_path(self):
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    # Moves a complete temp file into place under its digest
+    def _commit(self, tmp_path, digest, extension, size):
+        path = self.path_for(digest, extension)
+        with self._lock:
+            exists = digest in self.entries
+            if exists:
+                self.entries.move_to_end(digest)
+            else:
+                # Under the lock so two writers of the same image can't both count it
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+                self.entries[digest] = [extension, size, time.time()]
+                self.total_bytes += size
+        if exists:
+            os.unlink(tmp_path)
+            metrics.inc("image_store.deduplicated")
+        else:
+            metrics.inc("image_store.stored")
+        self._collect()
+        return digest
+
+    def _put_bytes(self, data):
+        extension = sniff_extension(data[:16])
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if digest in self.entries:
+                self.entries.move_to_end(digest)
+                metrics.inc("image_store.deduplicated")
+                return digest
+        tmp_path = self._tmp_path()
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            self._discard(tmp_path)
+            raise
+        return self._commit(tmp_path, digest, extension, len(data))
+
+    async def put(self, data):
+        if len(data) > self.max_image_bytes:
+            raise ValueError(f"Image is larger than {self.max_image_bytes} bytes")
+        return await asyncio.to_thread(self._put_bytes, data)
+
+    # Streams a download to disk while hashing it; the image is never held in memory whole
+    async def put_url(self, url, client):
+        tmp_path = self._tmp_path()
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            hasher = hashlib.sha256()
+            size = 0
+            extension = None
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(64 * 1024):
+                    if extension is None:
+                        extension = sniff_extension(chunk[:16])
+                    size += len(chunk)
+                    if size > self.max_image_bytes:
+                        raise ValueError(f"Image is larger than {self.max_image_bytes} bytes")
+                    hasher.update(chunk)
+                    await asyncio.to_thread(f.write, chunk)
+            if extension is None:
+                raise ValueError("Empty image")
+            await asyncio.to_thread(self._close_synced, f)
+        except BaseException:
+            await asyncio.to_thread(f.close)
+            await asyncio.to_thread(self._discard, tmp_path)
+            raise
+        try:
+            return await asyncio.to_thread(self._commit, tmp_path, hasher.hexdigest(), extension, size)
+        except OSError:
+            await asyncio.to_thread(self._discard, tmp_path)
+            raise
+
+    def _close_synced(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    def _discard(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    # Deletes least recently used images until the store is back under 90% of its cap
+    def _collect(self):
+        with self._lock:
+            if self.total_bytes <= self.max_bytes:
+                metrics.set_gauge("image_store.bytes", self.total_bytes)
+                return
+            victims = []
+            target = self.max_bytes * 9 // 10
+            while self.total_bytes > target and self.entries:
+                digest, (extension, size, _) = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                victims.append((digest, extension))
+            metrics.set_gauge("image_store.bytes", self.total_bytes)
+        for digest, extension in victims:
+            # Open file handles (responses in flight) keep working after the unlink
+            self._discard(self.path_for(digest, extension))
+        metrics.inc("image_store.evicted", len(victims))
+        logger.info(f"Image store evicted {len(victims)} least recently used images")
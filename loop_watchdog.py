@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Measures event-loop lag and, when the loop stays blocked past the threshold,
+# captures the stack of whatever is running on the loop thread
+class LoopWatchdog:
+    def __init__(self, interval=0.5, threshold=0.25, max_reports=20, debug=False):
+        self.interval = interval
+        self.threshold = threshold
+        self.debug = debug
+        self.reports = deque(maxlen=max_reports)  # recent stalls, newest last
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.debug:
+            # asyncio's own slow-callback reporting, logged by the asyncio logger
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Loop watchdog started (threshold {self.threshold * 1000:.0f}ms, debug={self.debug})")
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _measure(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._heartbeat = now
+            metrics.observe("loop.lag", lag)
+            metrics.set_gauge("loop.lag_ms", round(lag * 1000, 1))
+            if lag >= self.threshold:
+                metrics.inc("loop.lag_over_threshold")
+                logger.warning(f"Event loop lagged {lag * 1000:.0f}ms")
+
+    # Runs in its own thread, so it still wakes up while the loop is blocked
+    def _monitor(self):
+        reported_for = None
+        while not self._stopped.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            if blocked_for < self.threshold or reported_for == heartbeat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            reported_for = heartbeat
+            stack = "".join(traceback.format_stack(frame))
+            self.reports.append({'at': time.time(), 'blocked_ms': round(blocked_for * 1000), 'stack': stack})
+            metrics.inc("loop.stalls")
+            logger.warning(f"Event loop blocked for {blocked_for * 1000:.0f}ms, loop thread stack:\n{stack}")
+
+    def snapshot(self):
+        return list(self.reports)
@@ -0,0 +1,176 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"\w+")
+# Filler every prompt has; indexing it would only make posting lists huge
+STOP_WORDS = frozenset(("a", "an", "and", "the", "of", "in", "on", "with", "to", "is", "at", "by", "for", "meme"))
+
+def index_tokens(text):
+    return [token for token in WORD_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+# Delivered memes (Telegram file_id + caption) searchable by prompt words, for inline mode.
+# Everything is in memory: a posting list per token, a sorted vocabulary for prefix matches
+# on the word still being typed, and an LRU of recent query results. Entries are appended to
+# a JSON-lines file in batches and reloaded at startup.
+class MemeIndex:
+    def __init__(self, path="meme_index.jsonl", max_entries=20000, cache_size=1024, max_results=500):
+        self.path = path
+        self.max_entries = max_entries
+        self.cache_size = cache_size
+        self.max_results = max_results  # matches kept per query, newest first
+        self.entries = []  # [(key, file_id, caption)], oldest first; positions are entry IDs
+        self.keys = set()  # file_unique_ids already indexed
+        self.postings = {}  # {token: [entry IDs, ascending]}
+        self.vocabulary = []  # sorted tokens, for prefix lookups
+        self._results = OrderedDict()  # {query tokens: (entry IDs newest first)}
+        self._unsaved = []
+        self._flush_task = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        entries = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        entries.append((record["key"], record["file_id"], record["caption"]))
+                    except (ValueError, KeyError, TypeError):
+                        continue  # torn last line from a crash
+        except FileNotFoundError:
+            return
+        self._rebuild(entries[-self.max_entries:])
+        logger.info(f"Loaded {len(self.entries)} memes into the inline index")
+
+    def _rebuild(self, entries):
+        self.entries, self.keys, self.postings = [], set(), {}
+        for entry in entries:
+            self._insert(entry, sort=False)
+        self.vocabulary = sorted(self.postings)
+        self._results.clear()
+
+    def _insert(self, entry, sort=True):
+        if entry[0] in self.keys:
+            return False
+        entry_id = len(self.entries)
+        self.entries.append(entry)
+        self.keys.add(entry[0])
+        for token in set(index_tokens(entry[2])):
+            postings = self.postings.get(token)
+            if postings is None:
+                self.postings[token] = [entry_id]
+                if sort:
+                    bisect.insort(self.vocabulary, token)
+            else:
+                postings.append(entry_id)
+        return True
+
+    def add(self, key, file_id, caption):
+        entry = (key, file_id, caption or "")
+        if not self._insert(entry):
+            return
+        self._results.clear()
+        metrics.inc("meme_index.added")
+        if self._unsaved is not None:
+            self._unsaved.append(entry)
+        if len(self.entries) > self.max_entries * 5 // 4:
+            # Drop the oldest quarter and rewrite the file with what is left
+            self._rebuild(self.entries[-self.max_entries:])
+            self._unsaved = None
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+
+    # IDs of entries holding a token starting with prefix
+    def _prefix_ids(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + "\uffff")
+        tokens = self.vocabulary[start:end]
+        if len(tokens) == 1:
+            return self.postings[tokens[0]]
+        ids = set()
+        for token in tokens:
+            ids.update(self.postings[token])
+        return ids
+
+    # Matching entry IDs, newest first. Every word must match; the last one may be partial.
+    def search(self, query):
+        tokens = tuple(index_tokens(query))
+        cached = self._results.get(tokens)
+        if cached is not None:
+            self._results.move_to_end(tokens)
+            metrics.inc("meme_index.cache_hits")
+            return cached
+        metrics.inc("meme_index.cache_misses")
+        if not tokens:
+            matches = range(len(self.entries) - 1, max(-1, len(self.entries) - 1 - self.max_results), -1)
+        else:
+            candidates = [self.postings.get(token, ()) for token in tokens[:-1]]
+            candidates.append(self._prefix_ids(tokens[-1]))
+            candidates.sort(key=len)
+            if len(candidates) == 1 and isinstance(candidates[0], list):
+                # One exact token: its posting list is already in order
+                matches = candidates[0][:-self.max_results - 1:-1]
+                return self._remember(tokens, tuple(matches))
+            ids = set(candidates[0])
+            for other in candidates[1:]:
+                if not ids:
+                    break
+                ids.intersection_update(other)
+            matches = sorted(ids, reverse=True)[:self.max_results]
+        return self._remember(tokens, tuple(matches))
+
+    def _remember(self, tokens, result):
+        self._results[tokens] = result
+        if len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+        return result
+
+    # One page of (key, file_id, caption) and the next offset ("" on the last page)
+    def page(self, query, offset, limit):
+        matches = self.search(query)
+        entries = [self.entries[entry_id] for entry_id in matches[offset:offset + limit]]
+        next_offset = str(offset + limit) if offset + limit < len(matches) else ""
+        return entries, next_offset
+
+    def _append(self, entries):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for key, file_id, caption in entries:
+                f.write(json.dumps({"key": key, "file_id": file_id, "caption": caption}) + "\n")
+
+    def _rewrite(self, entries):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, file_id, caption in entries:
+                f.write(json.dumps({"key": key, "file_id": file_id, "caption": caption}) + "\n")
+        os.replace(tmp_path, self.path)
+
+    # Writes whatever was added since the last flush in one go; None means rewrite everything
+    async def _flush(self):
+        try:
+            while self._unsaved != []:
+                unsaved, self._unsaved = self._unsaved, []
+                if unsaved is None:
+                    await asyncio.to_thread(self._rewrite, list(self.entries))
+                else:
+                    await asyncio.to_thread(self._append, unsaved)
+        except OSError as e:
+            logger.error(f"Failed to save the meme index: {str(e)}")
+            # The batch may be half written; rewrite everything on the next flush instead of losing it
+            self._unsaved = None
+        finally:
+            self._flush_task = None
+
+    async def close(self):
+        if self._flush_task is not None:
+            await self._flush_task
@@ -0,0 +1,49 @@
+import time
+from collections import deque
+
+# In-process metrics shared by the bot and the webhook server
+COUNTERS = {}  # {name: number}
+GAUGES = {}  # {name: number}
+HISTOGRAMS = {}  # {name: deque([values])}
+HISTOGRAM_SIZE = 1024  # samples kept per histogram
+STARTED_AT = time.time()
+
+def inc(name, value=1):
+    COUNTERS[name] = COUNTERS.get(name, 0) + value
+
+def set_gauge(name, value):
+    GAUGES[name] = value
+
+def observe(name, value):
+    samples = HISTOGRAMS.get(name)
+    if samples is None:
+        samples = HISTOGRAMS[name] = deque(maxlen=HISTOGRAM_SIZE)
+    samples.append(value)
+
+def percentile(name, pct):
+    samples = HISTOGRAMS.get(name)
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+# Snapshot for the /metrics endpoint and log dumps
+def snapshot():
+    histograms = {}
+    for name, samples in HISTOGRAMS.items():
+        if not samples:
+            continue
+        histograms[name] = {
+            'count': len(samples),
+            'p50': percentile(name, 50),
+            'p90': percentile(name, 90),
+            'p99': percentile(name, 99),
+            'max': max(samples)
+        }
+    return {
+        'uptime': round(time.time() - STARTED_AT, 1),
+        'counters': dict(COUNTERS),
+        'gauges': dict(GAUGES),
+        'histograms': histograms
+    }
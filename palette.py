@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import io
+import logging
+import time
+from collections import OrderedDict
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # NumPy and Pillow are optional; without them the theme keeps its default colors
+    np = None
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Theme color names and their sRGB values; palettes are mapped onto these
+NAMED_COLORS = {
+    "red": (220, 30, 30), "blue": (30, 60, 220), "green": (40, 150, 50), "yellow": (250, 225, 40),
+    "purple": (120, 40, 150), "orange": (250, 140, 20), "pink": (250, 160, 190), "black": (15, 15, 15),
+    "white": (245, 245, 245), "turquoise": (64, 224, 208), "gold": (212, 175, 55), "silver": (192, 192, 192),
+    "violet": (170, 90, 230), "cyan": (0, 220, 240), "magenta": (230, 0, 200), "lime": (150, 240, 40),
+    "teal": (0, 128, 128), "emerald": (80, 200, 120), "ruby": (155, 17, 50), "sapphire": (15, 82, 186),
+    "amber": (255, 191, 0), "coral": (255, 127, 80), "lavender": (181, 150, 230), "bronze": (165, 105, 45),
+    "ivory": (250, 245, 220), "charcoal": (54, 62, 70), "peach": (255, 205, 165), "mint": (160, 240, 190)
+}
+
+def available():
+    return np is not None
+
+# sRGB (0-255) rows to CIELAB, so distances roughly follow perceived color difference
+def _to_lab(rgb):
+    rgb = np.asarray(rgb, dtype=np.float32) / 255.0
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array([
+        [0.4124, 0.2126, 0.0193],
+        [0.3576, 0.7152, 0.1192],
+        [0.1805, 0.0722, 0.9505]
+    ], dtype=np.float32)
+    xyz /= np.array([0.9505, 1.0, 1.089], dtype=np.float32)
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+_NAMED_LAB = None
+
+def _named_lab():
+    global _NAMED_LAB
+    if _NAMED_LAB is None:
+        _NAMED_LAB = (tuple(NAMED_COLORS), _to_lab(list(NAMED_COLORS.values())))
+    return _NAMED_LAB
+
+def _squared_distances(points, centers):
+    return ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+
+# Vectorized k-means (k-means++ seeding); returns (centers, share of pixels per center)
+def _kmeans(points, k, iterations, seed):
+    rng = np.random.default_rng(seed)
+    k = min(k, len(points))
+    centers = [points[rng.integers(len(points))]]
+    for _ in range(1, k):
+        nearest = _squared_distances(points, np.array(centers)).min(axis=1)
+        total = nearest.sum()
+        if total == 0:
+            break
+        centers.append(points[rng.choice(len(points), p=nearest / total)])
+    centers = np.array(centers)
+    for _ in range(iterations):
+        labels = _squared_distances(points, centers).argmin(axis=1)
+        counts = np.bincount(labels, minlength=len(centers))
+        sums = np.stack([np.bincount(labels, weights=points[:, c], minlength=len(centers)) for c in range(3)], axis=1)
+        occupied = counts > 0
+        updated = centers.copy()
+        updated[occupied] = sums[occupied] / counts[occupied, None]
+        if np.allclose(updated, centers, atol=0.5):
+            centers = updated
+            break
+        centers = updated
+    labels = _squared_distances(points, centers).argmin(axis=1)
+    return centers, np.bincount(labels, minlength=len(centers)) / len(points)
+
+# Dominant color names of an encoded image, most prominent first. Runs in a worker process.
+def dominant_colors(image_bytes, count=3, k=6, size=64, iterations=12, min_share=0.04):
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft("RGB", (size * 2, size * 2))  # lets JPEG decode at reduced scale
+    image = image.convert("RGBA")
+    image.thumbnail((size, size))
+    pixels = np.asarray(image, dtype=np.uint8).reshape(-1, 4)
+    pixels = pixels[pixels[:, 3] >= 128, :3]  # ignore transparent background
+    if len(pixels) == 0:
+        return []
+    centers, shares = _kmeans(_to_lab(pixels), k, iterations, seed=0)
+    names, named_lab = _named_lab()
+    nearest = _squared_distances(centers, named_lab).argmin(axis=1)
+    by_name = {}
+    for index, share in zip(nearest, shares):
+        by_name[names[index]] = by_name.get(names[index], 0.0) + float(share)
+    ranked = sorted(by_name.items(), key=lambda item: item[1], reverse=True)
+    return [name for name, share in ranked if share >= min_share][:count] or [ranked[0][0]]
+
+# Palette analysis off the event loop, cached per image content hash (and per URL for a while,
+# so rebuilding a chat's theme does not download the same image again)
+class PaletteAnalyzer:
+    def __init__(self, executor, fetch, cache_size=256, url_ttl=3600):
+        self.executor = executor  # () -> concurrent.futures.Executor
+        self.fetch = fetch  # async (url) -> image bytes
+        self.cache_size = cache_size
+        self.url_ttl = url_ttl
+        self._by_digest = OrderedDict()  # {sha256: [color names]}
+        self._by_url = OrderedDict()  # {url: (sha256, fetched_at)}
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    async def colors_for_url(self, url):
+        cached = self._by_url.get(url)
+        if cached and time.monotonic() - cached[1] < self.url_ttl and cached[0] in self._by_digest:
+            metrics.inc("palette.cache_hits")
+            return self._by_digest[cached[0]]
+        image_bytes = await self.fetch(url)
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        self._remember(self._by_url, url, (digest, time.monotonic()))
+        colors = self._by_digest.get(digest)
+        if colors is not None:
+            metrics.inc("palette.cache_hits")
+            return colors
+        start_time = time.monotonic()
+        loop = asyncio.get_running_loop()
+        colors = await loop.run_in_executor(self.executor(), dominant_colors, image_bytes)
+        metrics.observe("palette.latency", time.monotonic() - start_time)
+        metrics.inc("palette.analyzed")
+        self._remember(self._by_digest, digest, colors)
+        logger.info(f"Palette for {url}: {', '.join(colors)}")
+        return colors
@@ -0,0 +1,52 @@
+import time
+
+from telegram.ext import filters
+
+import metrics
+
+# Keys (chat IDs, user IDs) that currently expect free-text input, with expiry
+class PendingInputIndex:
+    def __init__(self, name, ttl=300):
+        self.name = name
+        self.ttl = ttl
+        self._deadlines = {}  # {key: monotonic deadline}
+
+    def add(self, key, ttl=None):
+        self._deadlines[key] = time.monotonic() + (ttl or self.ttl)
+        metrics.set_gauge(f"pending.{self.name}", len(self._deadlines))
+
+    def discard(self, key):
+        if self._deadlines.pop(key, None) is not None:
+            metrics.set_gauge(f"pending.{self.name}", len(self._deadlines))
+
+    def __contains__(self, key):
+        deadline = self._deadlines.get(key)
+        if deadline is None:
+            return False
+        if deadline < time.monotonic():
+            # Expired entries are dropped on first lookup
+            self.discard(key)
+            metrics.inc(f"pending.{self.name}.expired")
+            return False
+        return True
+
+    def __len__(self):
+        return len(self._deadlines)
+
+# Message filter that only lets through messages whose chat/user is in the index,
+# so plain chatter is rejected before any handler coroutine is scheduled
+class PendingInputFilter(filters.MessageFilter):
+    def __init__(self, index, by="chat"):
+        super().__init__(name=f"PendingInputFilter({index.name})")
+        self.index = index
+        self.by = by
+
+    def filter(self, message):
+        if self.by == "user":
+            key = message.from_user.id if message.from_user else None
+        else:
+            key = message.chat_id
+        if key in self.index:
+            return True
+        metrics.inc(f"pending.{self.index.name}.rejected")
+        return False
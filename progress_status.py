@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import TelegramError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Shared per-chat edit clock, so status edits in one chat stay under Telegram's limits
+class StatusEditCoalescer:
+    def __init__(self, min_interval=3.0):
+        self.min_interval = min_interval
+        self.last_edit = {}  # {chat_id: monotonic timestamp of the last edit}, recent edits only
+        self._pruned_at = time.monotonic()
+
+    def track(self, message):
+        return StatusMessage(self, message)
+
+    def record(self, chat_id):
+        now = time.monotonic()
+        self.last_edit[chat_id] = now
+        if now - self._pruned_at >= self.min_interval:
+            # Entries older than the interval no longer delay anything; forget them
+            self._pruned_at = now
+            for stale in [key for key, edited_at in self.last_edit.items() if now - edited_at >= self.min_interval]:
+                del self.last_edit[stale]
+
+    def wait_for(self, chat_id):
+        return self.last_edit.get(chat_id, 0) + self.min_interval - time.monotonic()
+
+# A status message that is edited in place; updates arriving faster than the
+# chat's edit interval are coalesced and only the latest text is sent
+class StatusMessage:
+    def __init__(self, coalescer, message):
+        self.coalescer = coalescer
+        self.message = message
+        self.shown_text = message.text
+        self.pending_text = None
+        self.closed = False
+        self._task = None
+
+    def update(self, text):
+        if self.closed or text == self.shown_text:
+            return
+        if self.pending_text is not None:
+            metrics.inc("progress.coalesced")
+        self.pending_text = text
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        chat_id = self.message.chat_id
+        try:
+            while self.pending_text is not None and not self.closed:
+                wait = self.coalescer.wait_for(chat_id)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                text, self.pending_text = self.pending_text, None
+                if text == self.shown_text:
+                    continue
+                self.coalescer.record(chat_id)
+                await self.message.edit_text(text)
+                self.shown_text = text
+                metrics.inc("progress.edits")
+        except TelegramError as e:
+            logger.warning(f"Failed to edit status message in chat {chat_id}: {str(e)}")
+            metrics.inc("progress.edit_failed")
+        finally:
+            self._task = None
+
+    # Stop editing; pending updates are dropped
+    async def close(self):
+        self.closed = True
+        self.pending_text = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
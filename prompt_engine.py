@@ -0,0 +1,72 @@
+import functools
+import random
+
+# Compiled prompt template for one chat: the static parts are formatted once,
+# renders only pick slot values and do a single join
+class PromptTemplate:
+    def __init__(self, main_character, ticker, objects, styles, scenes, colors):
+        self.main_character = main_character
+        self.ticker = ticker
+        self.objects = tuple(objects)
+        self.styles = tuple(styles)
+        self.scenes = tuple(scenes)
+        self.colors = tuple(colors)
+        self._scene_set = frozenset(self.scenes)
+        self._color_set = frozenset(self.colors)
+        self._character_suffix = f" illustration of {main_character}"
+        self._crown = f", with a golden crown and {ticker} symbol"
+        self._crown_plain = ", with a golden crown"
+        self._tail = ", vibrant, humorous, high-quality, meme-inspired"
+
+    # Slot values for a render; explicit values win, the rest come from the seeded RNG
+    def pick(self, seed=None, scene=None, color=None, object_sitting=None, style=None):
+        rng = random.Random(seed)
+        # Draw in a fixed order so a seed always yields the same picks
+        random_color = rng.choice(self.colors)
+        random_scene = rng.choice(self.scenes)
+        random_object = rng.choice(self.objects)
+        random_style = rng.choice(self.styles)
+        return {
+            'color': color if color in self._color_set else random_color,
+            'scene': scene if scene in self._scene_set else random_scene,
+            'object': object_sitting or random_object,
+            'style': style or random_style
+        }
+
+    # text_in_image=False leaves the ticker and custom text out of the prompt (they are drawn locally)
+    def render(self, description=None, scene=None, custom_text=None, color=None,
+               additional_characters=None, object_sitting=None, seed=None, text_in_image=True):
+        slots = self.pick(seed, scene, color, object_sitting)
+        parts = ["A ", slots['style'], self._character_suffix]
+        if additional_characters:
+            parts += [" with ", ", ".join(additional_characters)]
+        if description:
+            parts += [" ", description]
+        else:
+            parts += [" sitting confidently on ", slots['object']]
+        parts.append(self._crown if text_in_image else self._crown_plain)
+        parts += [", in a dramatic ", slots['scene'], " setting"]
+        parts += [", colored in vibrant ", slots['color']]
+        if custom_text and text_in_image:
+            parts += [", with the text '", custom_text, "' prominently displayed on the image"]
+        parts.append(self._tail)
+        return "".join(parts)
+
+    # Variations of one request: seeds seed, seed + 1, ... (random base seed when None)
+    def render_batch(self, count, seed=None, **fields):
+        base_seed = seed if seed is not None else random.getrandbits(32)
+        return [(base_seed + i, self.render(seed=base_seed + i, **fields)) for i in range(count)]
+
+@functools.lru_cache(maxsize=1024)
+def _compile(main_character, ticker, objects, styles, scenes, colors):
+    return PromptTemplate(main_character, ticker, objects, styles, scenes, colors)
+
+# Template for a chat's character/ticker and theme vocabularies, compiled once and reused
+def compile_template(main_character, ticker, theme):
+    return _compile(
+        main_character, ticker,
+        tuple(theme['objects']), tuple(theme['styles']), tuple(theme['scenes']), tuple(theme['colors'])
+    )
+
+def new_seed():
+    return random.getrandbits(32)
@@ -0,0 +1,67 @@
+import logging
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# One generation profile: extra model inputs and, optionally, a preferred backend
+class QualityProfile:
+    def __init__(self, name, options=None, backend=None, max_depth=None, max_latency=None):
+        self.name = name
+        self.options = options or {}
+        self.backend = backend
+        self.max_depth = max_depth  # queue depth this profile can still absorb
+        self.max_latency = max_latency  # backend latency (seconds) this profile can still absorb
+
+# Picks the cheapest profile the current load calls for. Steps down immediately when
+# load rises, but only steps back up after load has stayed low for recover_after seconds.
+class QualityPolicy:
+    def __init__(self, profiles, load, recover_after=60):
+        self.profiles = profiles  # ordered from full quality to cheapest
+        self.load = load  # () -> (queue_depth, latency_seconds or None)
+        self.recover_after = recover_after
+        self.level = 0
+        self._calm_since = None
+        metrics.set_gauge("quality.profile", profiles[0].name)
+
+    def _level_for(self, depth, latency):
+        for level, profile in enumerate(self.profiles):
+            depth_ok = profile.max_depth is None or depth <= profile.max_depth
+            latency_ok = profile.max_latency is None or latency is None or latency <= profile.max_latency
+            if depth_ok and latency_ok:
+                return level
+        return len(self.profiles) - 1
+
+    def choose(self):
+        depth, latency = self.load()
+        target = self._level_for(depth, latency)
+        now = time.monotonic()
+        if target > self.level:
+            self._set_level(target, depth, latency)
+            self._calm_since = None
+        elif target < self.level:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.recover_after:
+                # Recover one step at a time
+                self._set_level(self.level - 1, depth, latency)
+                self._calm_since = now
+        else:
+            self._calm_since = None
+        return self.profiles[self.level]
+
+    def _set_level(self, level, depth, latency):
+        latency_text = f"{latency:.1f}s" if latency is not None else "n/a"
+        logger.warning(
+            f"Quality profile {self.profiles[self.level].name} -> {self.profiles[level].name} "
+            f"(queue depth {depth}, latency {latency_text})"
+        )
+        self.level = level
+        metrics.set_gauge("quality.profile", self.profiles[level].name)
+        metrics.inc(f"quality.switch_to.{self.profiles[level].name}")
+
+    # Per-profile outcome, so latency and quality can be compared between profiles
+    def record(self, profile, latency, ok):
+        metrics.observe(f"quality.{profile.name}.latency", latency)
+        metrics.inc(f"quality.{profile.name}.{'ok' if ok else 'failed'}")
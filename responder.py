@@ -0,0 +1,112 @@
+import random
+import re
+import string
+
+# Keywords and phrases per intent. Earlier intents win ties, so safety topics come first.
+INTENT_KEYWORDS = {
+    'scam': ["scam", "scammer", "rug", "rugged", "rug pull", "rugpull", "honeypot", "fake", "phishing",
+             "drainer", "hacked", "legit", "is it safe"],
+    'wallet': ["wallet", "suiet", "slush", "sui wallet", "seed phrase", "connect wallet", "metamask", "phantom"],
+    'airdrop': ["airdrop", "giveaway", "claim", "free tokens", "whitelist", "wl", "snapshot"],
+    'price': ["price", "chart", "mcap", "market cap", "ath", "worth", "dump", "dumping", "dip", "buy",
+              "sell", "how much", "volume", "liquidity"],
+    'technical': ["contract", "ca", "smart contract", "code", "gas", "transaction", "tx", "bug", "error",
+                  "audit", "move", "token address"],
+    'website': ["website", "site", "link", "url", "landing page", "web"],
+    'future_coin': ["future", "roadmap", "plan", "plans", "next", "listing", "cex", "dex", "utility", "partnership"],
+    'community': ["community", "telegram", "tg", "twitter", "x", "raid", "join", "holders", "group"],
+    'hype': ["moon", "lfg", "wagmi", "bullish", "send it", "pump", "pump it", "to the moon", "lambo",
+             "gem", "100x", "1000x", "mooning"],
+    'complaint': ["sucks", "bad", "hate", "trash", "boring", "slow", "broken", "annoying", "worst", "down"],
+    'greeting': ["hi", "hello", "hey", "yo", "sup", "gm", "gn", "good morning", "whats up", "howdy", "ayy"],
+    'confused': ["huh", "wtf", "confused", "idk", "what the", "makes no sense", "lost"],
+    'question': ["how", "what", "why", "when", "who", "where", "?", "can you", "is there"]
+}
+# Weak signals: these only decide when nothing more specific matched
+WEAK_INTENTS = frozenset({'question'})
+PHRASE_WEIGHT = 2.0
+WORD_WEIGHT = 1.0
+WEAK_WEIGHT = 0.25
+
+DYNAMIC_FIELDS = {'slang': 'slang', 'meme_term': 'meme_terms', 'suimeme_term': 'suimeme_terms', 'emoji': 'emojis'}
+DYNAMIC_TAIL = " {slang}! {emoji}"  # appended to templates that use no dynamic words themselves
+TOKEN_PATTERN = re.compile(r"[\w$]+|\?")
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower().replace("'", "").replace("’", ""))
+
+# Keyword/phrase index compiled once: single words map straight to intents, phrases are
+# bucketed by their first word so each message token costs at most two dict lookups
+class IntentIndex:
+    def __init__(self, keywords):
+        self.intents = tuple(keywords)
+        self.words = {}  # {token: ((intent, weight), ...)}
+        self.phrases = {}  # {first token: ((tokens, intent, weight), ...)}
+        words = {}
+        phrases = {}
+        for intent, entries in keywords.items():
+            weak = intent in WEAK_INTENTS
+            for entry in entries:
+                tokens = tuple(tokenize(entry))
+                if not tokens:
+                    raise ValueError(f"Keyword {entry!r} for intent {intent!r} has no words")
+                if len(tokens) == 1:
+                    words.setdefault(tokens[0], []).append((intent, WEAK_WEIGHT if weak else WORD_WEIGHT))
+                else:
+                    phrases.setdefault(tokens[0], []).append(
+                        (tokens, intent, WEAK_WEIGHT if weak else PHRASE_WEIGHT)
+                    )
+        self.words = {token: tuple(matches) for token, matches in words.items()}
+        self.phrases = {token: tuple(matches) for token, matches in phrases.items()}
+        self._rank = {intent: position for position, intent in enumerate(self.intents)}
+
+    def classify(self, text, default="default"):
+        tokens = tokenize(text)
+        scores = {}
+        for position, token in enumerate(tokens):
+            for intent, weight in self.words.get(token, ()):
+                scores[intent] = scores.get(intent, 0.0) + weight
+            for phrase, intent, weight in self.phrases.get(token, ()):
+                if tuple(tokens[position:position + len(phrase)]) == phrase:
+                    scores[intent] = scores.get(intent, 0.0) + weight
+        if not scores:
+            return default
+        return max(scores, key=lambda intent: (scores[intent], -self._rank[intent]))
+
+# Immutable /hey responder built from responses.json and dynamic_words.json
+class Responder:
+    def __init__(self, responses, dynamic_words, keywords=INTENT_KEYWORDS):
+        if not isinstance(responses, dict) or not isinstance(dynamic_words, dict):
+            raise ValueError("Responses and dynamic words must be JSON objects")
+        self.templates = {}
+        for intent, templates in responses.items():
+            if not isinstance(templates, list) or not all(isinstance(t, str) for t in templates):
+                raise ValueError(f"Responses for intent {intent!r} must be a list of strings")
+            compiled = []
+            for template in templates:
+                fields = {field for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+                unknown = fields - {'username'} - set(DYNAMIC_FIELDS)
+                if unknown:
+                    raise ValueError(f"Unknown placeholder {{{unknown.pop()}}} in {intent!r} response: {template}")
+                compiled.append(template if fields & set(DYNAMIC_FIELDS) else template + DYNAMIC_TAIL)
+            if compiled:
+                self.templates[intent] = tuple(compiled)
+        self.words = {}
+        for field, key in DYNAMIC_FIELDS.items():
+            pool = dynamic_words.get(key, [])
+            if not isinstance(pool, list) or not all(isinstance(w, str) for w in pool):
+                raise ValueError(f"Dynamic words {key!r} must be a list of strings")
+            self.words[field] = tuple(pool) or ("",)
+        self.index = IntentIndex({intent: words for intent, words in keywords.items() if intent in self.templates})
+
+    def classify(self, text):
+        return self.index.classify(text)
+
+    def reply(self, text, username, rng=random):
+        intent = self.classify(text)
+        templates = self.templates.get(intent) or self.templates.get('default')
+        if not templates:
+            return intent, None
+        fields = {field: rng.choice(pool) for field, pool in self.words.items()}
+        fields['username'] = username
+        return intent, rng.choice(templates).format_map(fields)
@@ -0,0 +1,195 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SUI_MAINNET_RPC_URL = "https://fullnode.mainnet.sui.io:443"
+
+class SuiRpcError(Exception):
+    pass
+
+# JSON-RPC errors are meant to be {"code", "message"} objects, but some nodes send a bare string
+def error_message(error):
+    if isinstance(error, dict):
+        return str(error.get("message", error))
+    return str(error) if error is not None else None
+
+# Async Sui JSON-RPC client shared by all chats:
+# - one pooled HTTP client
+# - calls made within batch_window seconds go upstream as one JSON-RPC batch
+# - read results are cached for a TTL, and concurrent identical reads share one call
+class SuiRpcClient:
+    def __init__(self, url=SUI_MAINNET_RPC_URL, timeout=10.0, batch_window=0.01, max_batch=50,
+                 cache_ttl=30, cache_size=4096, max_connections=20):
+        self.url = url
+        self.timeout = timeout
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.max_connections = max_connections
+        self._client = None
+        self._ids = itertools.count(1)
+        self._pending = []  # [(request_id, method, params, future)] waiting for the next batch
+        self._flush_handle = None
+        self._cache = {}  # {(method, params json): (expires_at, result)}
+        self._in_flight = {}  # {(method, params json): future}
+        self._tasks = set()
+
+    def _get_client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                headers={"Content-Type": "application/json"}
+            )
+        return self._client
+
+    # One uncached call; batched with whatever else is issued in the same window
+    def call(self, method, params):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((next(self._ids), method, params, future))
+        metrics.inc("sui_rpc.calls")
+        if len(self._pending) >= self.max_batch:
+            self._flush_now()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush_now)
+        return future
+
+    def _flush_now(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch):
+        payload = [{"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}
+                   for request_id, method, params, _ in batch]
+        start_time = time.monotonic()
+        metrics.inc("sui_rpc.upstream_requests")
+        try:
+            response = await self._get_client().post(self.url, content=json.dumps(payload))
+            response.raise_for_status()
+            results = response.json()
+            if isinstance(results, dict):
+                # Some nodes answer a whole failed batch with a single error object
+                raise SuiRpcError(error_message(results.get("error")) or "Invalid batch response")
+            if not isinstance(results, list):
+                raise SuiRpcError("Invalid batch response")
+            by_id = {result.get("id"): result for result in results if isinstance(result, dict)}
+            for request_id, method, _, future in batch:
+                if future.done():
+                    continue
+                result = by_id.get(request_id)
+                if result is None:
+                    future.set_exception(SuiRpcError(f"No response for {method}"))
+                elif result.get("error") is not None:
+                    metrics.inc("sui_rpc.errors")
+                    future.set_exception(SuiRpcError(f"{method} failed: {error_message(result['error'])}"))
+                else:
+                    future.set_result(result.get("result"))
+        except Exception as e:
+            metrics.inc("sui_rpc.errors")
+            logger.warning(f"Sui RPC batch of {len(batch)} failed: {str(e)}")
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(SuiRpcError(f"Sui RPC error: {str(e)}"))
+        finally:
+            metrics.observe("sui_rpc.latency", time.monotonic() - start_time)
+            # Nothing may be left waiting forever, whatever happened above (including cancellation)
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(SuiRpcError("Sui RPC request was aborted"))
+
+    # Cached, single-flight read: identical calls share one upstream request and its result
+    async def cached(self, method, params, ttl=None):
+        key = (method, json.dumps(params, separators=(",", ":")))
+        now = time.monotonic()
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > now:
+            metrics.inc("sui_rpc.cache_hits")
+            return entry[1]
+        future = self._in_flight.get(key)
+        if future is not None:
+            metrics.inc("sui_rpc.coalesced")
+            return await asyncio.shield(future)
+        future = self.call(method, params)
+        self._in_flight[key] = future
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            self._in_flight.pop(key, None)
+        self._store(key, result, now + (self.cache_ttl if ttl is None else ttl))
+        return result
+
+    def _store(self, key, result, expires_at):
+        if len(self._cache) >= self.cache_size:
+            now = time.monotonic()
+            for stale in [k for k, (expiry, _) in self._cache.items() if expiry <= now]:
+                del self._cache[stale]
+            while len(self._cache) >= self.cache_size:
+                del self._cache[next(iter(self._cache))]
+        self._cache[key] = (expires_at, result)
+
+    async def get_coin_metadata(self, coin_type):
+        # Metadata practically never changes
+        return await self.cached("suix_getCoinMetadata", [coin_type], ttl=3600)
+
+    async def get_total_supply(self, coin_type):
+        return await self.cached("suix_getTotalSupply", [coin_type])
+
+    async def get_balance(self, owner, coin_type, ttl=None):
+        return await self.cached("suix_getBalance", [owner, coin_type], ttl)
+
+    # Latest transactions sent by address, newest first, with their balance changes; never cached
+    async def get_transactions_from(self, address, limit=20):
+        query = {"filter": {"FromAddress": address}, "options": {"showBalanceChanges": True}}
+        page = await self.call("suix_queryTransactionBlocks", [query, None, limit, True])
+        if not isinstance(page, dict) or not isinstance(page.get("data"), list):
+            raise SuiRpcError(f"Invalid transaction page for {address}")
+        return page["data"]
+
+    # Metadata and supply in one round trip: {'name', 'symbol', 'decimals', 'supply', ...}
+    async def get_coin_info(self, coin_type):
+        metadata, supply = await asyncio.gather(self.get_coin_metadata(coin_type), self.get_total_supply(coin_type))
+        if metadata is None:
+            raise SuiRpcError(f"No coin metadata for {coin_type}")
+        # Odd node replies must surface as SuiRpcError, which is all callers handle
+        if not isinstance(metadata, dict):
+            raise SuiRpcError(f"Invalid coin metadata for {coin_type}")
+        decimals = metadata.get("decimals", 0)
+        if type(decimals) is not int or not 0 <= decimals <= 255:
+            raise SuiRpcError(f"Invalid decimals for {coin_type}: {decimals!r}")
+        if supply is not None:
+            try:
+                supply = int(supply["value"]) / 10 ** decimals
+            except (KeyError, TypeError, ValueError):
+                raise SuiRpcError(f"Invalid total supply for {coin_type}") from None
+        return {
+            'coin_type': coin_type,
+            'name': metadata.get("name"),
+            'symbol': metadata.get("symbol"),
+            'decimals': decimals,
+            'icon_url': metadata.get("iconUrl"),
+            'supply': supply
+        }
+
+    async def close(self):
+        self._flush_now()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -5,17 +5,45 @@ import logging
 import json
 import re
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMemberAdministrator, ChatMemberOwner
-from telegram.constants import ChatAction
-from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, filters
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMemberAdministrator, ChatMemberOwner, InlineQueryResultCachedPhoto, InputMediaPhoto
+from telegram.constants import ChatAction, ChatType
+from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, InlineQueryHandler, filters
 from telegram.error import TelegramError
 import functools
 import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+import hmac
+import secrets
 from googlesearch import search
 import validators
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import FileResponse
 import uvicorn
+import metrics
+from prompt_engine import compile_template, new_seed
+from theme import Theme
+from loop_watchdog import LoopWatchdog
+from pending_filter import PendingInputIndex, PendingInputFilter
+from generation_journal import GenerationJournal, DELIVERED, FAILED, EXPIRED, CANCELLED
+from warm_pool import WarmPool
+from progress_status import StatusEditCoalescer
+from responder import Responder
+from chat_settings import ChatSettings, load_chat_settings, write_chat_settings
+from sui_rpc import SuiRpcClient, SuiRpcError, SUI_MAINNET_RPC_URL
+from meme_index import MemeIndex
+from gallery import GalleryStore
+from image_store import ImageStore
+from holder_gate import HolderGate, HOLDER_OK, HOLDER_UNLINKED, HOLDER_UNKNOWN, MIST_PER_SUI
+from hot_reload import ReloadableData
+import text_overlay
+import palette
+from palette import PaletteAnalyzer
+from text_overlay import TextOverlayRenderer
+from quality_policy import QualityProfile, QualityPolicy
+from dispatch import ChatOrderedUpdateProcessor, allowed_updates_for, is_allowed_update
+from image_backend import BackendRouter, ReplicateBackend, LocalStubBackend, SDXL_VERSION, PREDICTION_REPLACED
 
 # Load environment variables
 load_dotenv()
@@ -34,56 +62,49 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load responses and dynamic words with fallbacks
-try:
-    with open("responses.json", "r", encoding="utf-8") as f:
-        HEY_RESPONSES = json.load(f)
-except FileNotFoundError:
-    logger.warning("responses.json not found, using default responses")
-    HEY_RESPONSES = {}
-    with open("responses.json", "w", encoding="utf-8") as f:
-        json.dump(HEY_RESPONSES, f)
-
+# Data files (responses, dynamic words, prompt vocabularies) are reloaded when edited,
+# without a restart; a malformed edit keeps the last good version
+DATA_RELOAD_INTERVAL = float(os.getenv("DATA_RELOAD_INTERVAL", 2))  # seconds between mtime checks
+HEY_FALLBACK = "Yo, slime fam! I'm not available to talk for now, but keep the $SUIMEME vibes flowin'! 💦"
+VOCABULARY_KEYS = ('objects', 'styles', 'scenes', 'colors')
+
+# /hey responder: intent index and templates compiled from responses.json and dynamic_words.json
+def build_responder(data):
+    if data["responses.json"] is None:
+        logger.warning("responses.json not found, /hey uses the fallback reply")
+    if data["dynamic_words.json"] is None:
+        logger.warning("dynamic_words.json not found, using no dynamic words")
+    return Responder(data["responses.json"] or {}, data["dynamic_words.json"] or {})
+
+# Prompt vocabularies from vocabularies.json: {'objects': (...), 'styles': ..., 'scenes': ..., 'colors': ...}
+def build_vocabulary(data):
+    data = data["vocabularies.json"]
+    if not isinstance(data, dict):
+        raise ValueError("vocabularies.json must be a JSON object")
+    vocabulary = {}
+    for key in VOCABULARY_KEYS:
+        words = data.get(key)
+        if not isinstance(words, list) or not words or not all(isinstance(w, str) and w.strip() for w in words):
+            raise ValueError(f"vocabularies.json '{key}' must be a non-empty list of strings")
+        vocabulary[key] = tuple(words)
+    return types.MappingProxyType(vocabulary)
+
+# Themes were compiled from the old vocabulary; they are rebuilt on next use
+def vocabulary_reloaded(vocabulary):
+    for chat_id in list(CHAT_THEMES):
+        WARM_POOL.invalidate(chat_id)
+    CHAT_THEMES.clear()
+
+RESPONSES = ReloadableData("responses", ["responses.json", "dynamic_words.json"], build_responder, DATA_RELOAD_INTERVAL)
+VOCABULARY = ReloadableData(
+    "vocabulary", ["vocabularies.json"], build_vocabulary, DATA_RELOAD_INTERVAL,
+    on_reload=vocabulary_reloaded
+)
 try:
-    with open("dynamic_words.json", "r", encoding="utf-8") as f:
-        DYNAMIC_WORDS = json.load(f)
-except FileNotFoundError:
-    logger.warning("dynamic_words.json not found, using default words")
-    DYNAMIC_WORDS = {}
-    with open("dynamic_words.json", "w", encoding="utf-8") as f:
-        json.dump(DYNAMIC_WORDS, f)
-
-# Default lists
-DEFAULT_OBJECTS = [
-    "a golden throne", "a pile of crypto coins", "a giant pizza", "a flaming dumpster", "a rocket ship",
-    "a bean bag", "a stack of memes", "a cloud of glitter", "a disco ball", "a vintage typewriter",
-    "a glowing lightsaber", "a treasure chest", "a giant rubber duck", "a holographic globe",
-    "a floating island", "a neon sign", "a steampunk airship", "a crystal skull", "a massive cupcake",
-    "a levitating book", "a robotic arm", "a glowing portal", "a pirate ship wheel",
-    "a diamond-encrusted crown", "a retro arcade machine", "a mystical obelisk", "a floating lantern",
-    "a giant hourglass"
-]
-
-DEFAULT_STYLES = [
-    "cartoon-style", "pixel art", "anime-style", "retro meme aesthetic", "realistic", "cyberpunk",
-    "watercolor", "surrealist", "steampunk", "minimalist", "oil painting", "vaporwave", "gothic",
-    "abstract", "pop art", "baroque", "futuristic", "pastel", "graffiti", "stained glass",
-    "line art", "3D render", "chalkboard sketch"
-]
-
-DEFAULT_SCENES = [
-    "explosion", "fireworks", "storm", "rainbow", "space", "underwater", "volcano", "party", "wwe ring",
-    "haunted forest", "city skyline at night", "desert oasis", "frozen tundra", "neon-lit alley",
-    "ancient ruins", "floating city", "cosmic void", "enchanted castle", "bamboo forest",
-    "post-apocalyptic wasteland", "underwater coral reef", "sky temple", "alien marketplace",
-    "victorian ballroom", "cybernetic jungle", "lunar surface", "carnival at dusk"
-]
-
-DEFAULT_COLORS = [
-    "red", "blue", "green", "yellow", "purple", "orange", "pink", "black", "white", "turquoise",
-    "gold", "silver", "violet", "cyan", "magenta", "lime", "teal", "emerald", "ruby", "sapphire",
-    "amber", "coral", "lavender", "bronze", "ivory", "charcoal", "peach", "mint"
-]
+    RESPONSES.load()
+except ValueError as e:
+    logger.error(f"Invalid responses.json/dynamic_words.json, /hey falls back to a fixed reply: {str(e)}")
+VOCABULARY.load()  # required; fail fast at startup
 
 # Cooldown and rate limit settings
 SUIMEME_COOLDOWN = 5  # seconds
@@ -96,8 +117,183 @@ MIN_REQUEST_GAP = 0.1  # minimum seconds between requests
 
 # Storage for cooldowns and active requests
 COOLDOWN_STORAGE = {}  # {f"{chat_id}_{user_id}": timestamp}
-ACTIVE_REQUESTS = {}  # {f"{chat_id}_{user_id}": bool}
+ACTIVE_REQUESTS = {}  # {f"{chat_id}_{user_id}": request token, falsy when idle}
 USER_REQUEST_COUNTS = {}  # {f"{chat_id}_{user_id}": [timestamps]}
+CHAT_THEMES = {}  # {chat_id: Theme}
+CHAT_SETTINGS_PATH = os.getenv("CHAT_SETTINGS_PATH", "chat_settings.json")
+CHAT_SETTINGS = load_chat_settings(CHAT_SETTINGS_PATH)  # {chat_id: ChatSettings}
+SETTINGS_SAVE_DELAY = 2  # seconds; changes within this window are written together
+SETTINGS_SAVE = {'task': None, 'lock': None}
+SETTING_INPUT_TTL = 300  # seconds a settings button waits for the admin's text reply
+PENDING_SETTINGS = PendingInputIndex("settings", ttl=SETTING_INPUT_TTL)  # chats awaiting a setting value
+STATUS_EDIT_INTERVAL = float(os.getenv("STATUS_EDIT_INTERVAL", 3))  # min seconds between status edits per chat
+STATUS_EDITS = StatusEditCoalescer(min_interval=STATUS_EDIT_INTERVAL)
+
+# Generation journal: accepted jobs survive restarts and are delivered by the next process
+GENERATION_JOURNAL_PATH = os.getenv("GENERATION_JOURNAL_PATH", "generation_journal.db")
+JOURNAL_RESUME_MAX_AGE = 3600  # seconds; older predictions' outputs have expired upstream
+JOURNAL_KEEP_FINISHED = 7 * 24 * 3600  # seconds finished jobs stay in the journal
+GENERATION_JOURNAL = GenerationJournal(GENERATION_JOURNAL_PATH)
+BACKGROUND_TASKS = set()  # strong references to fire-and-forget tasks
+
+# Warm pool: pre-generated memes for argument-less /SUIMEME, filled while the image backend is idle.
+# Off by default since it spends GPU time on images nobody may ask for.
+WARM_POOL_ENABLED = os.getenv("WARM_POOL_ENABLED", "false").lower() == "true"
+
+# Local text overlay: custom text and the ticker badge are drawn with Pillow (in worker
+# processes) instead of asking SDXL to render them. Needs Pillow; off when it is missing.
+TEXT_OVERLAY_ENABLED = os.getenv("TEXT_OVERLAY", "true").lower() == "true" and text_overlay.available()
+TEXT_OVERLAY_FONT = os.getenv("TEXT_OVERLAY_FONT", text_overlay.DEFAULT_FONT)
+IMAGE_WORKER_COUNT = int(os.getenv("IMAGE_WORKERS", 2))  # processes for Pillow and NumPy work
+IMAGE_WORKERS = None
+DOWNLOAD_CLIENT = None
+
+def image_workers():
+    global IMAGE_WORKERS
+    if IMAGE_WORKERS is None:
+        IMAGE_WORKERS = ProcessPoolExecutor(max_workers=IMAGE_WORKER_COUNT)
+    return IMAGE_WORKERS
+
+def download_client():
+    global DOWNLOAD_CLIENT
+    if DOWNLOAD_CLIENT is None or DOWNLOAD_CLIENT.is_closed:
+        DOWNLOAD_CLIENT = httpx.AsyncClient(timeout=30.0, follow_redirects=True)
+    return DOWNLOAD_CLIENT
+
+IMAGE_DOWNLOAD_MAX_BYTES = 10 * 1024 * 1024
+
+async def fetch_image(image_url):
+    chunks = []
+    size = 0
+    async with download_client().stream("GET", image_url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > IMAGE_DOWNLOAD_MAX_BYTES:
+                raise ValueError(f"Image at {image_url} is larger than {IMAGE_DOWNLOAD_MAX_BYTES} bytes")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+# Sui chain data, one client (pool, batches, cache) shared by all chats
+SUI_RPC_URL = os.getenv("SUI_RPC_URL", SUI_MAINNET_RPC_URL)
+SUI_RPC = SuiRpcClient(SUI_RPC_URL, cache_ttl=30)
+
+# Holder gate: groups with a minimum holding only serve members whose linked address holds it
+LINKED_ADDRESSES_PATH = os.getenv("LINKED_ADDRESSES_PATH", "linked_addresses.json")
+HOLDER_GATE = HolderGate(
+    SUI_RPC, LINKED_ADDRESSES_PATH,
+    ttl=3600,  # seconds a verified balance is trusted
+    recheck_interval=60  # seconds between background sweeps for balances past half their TTL
+)
+HOLDER_GATE.load()
+
+# Inline mode (@bot <words>): memes delivered in groups, searchable by prompt words and
+# answered from Telegram's cached file_ids without touching the image backend
+MEME_INDEX_PATH = os.getenv("MEME_INDEX_PATH", "meme_index.jsonl")
+MEME_INDEX = MemeIndex(MEME_INDEX_PATH, max_entries=20000)
+MEME_INDEX.load()
+INLINE_PAGE_SIZE = 20  # results per inline page (Telegram allows 50)
+INLINE_CACHE_TIME = 30  # seconds Telegram may cache an inline answer
+
+# Gallery: every delivered meme with its prompt and parsed fields, full-text searchable
+# through /gallery and GET /gallery. Rows are written in background batches.
+GALLERY_PATH = os.getenv("GALLERY_PATH", "gallery.db")
+GALLERY = GalleryStore(GALLERY_PATH, batch_size=100, flush_interval=1.0)
+GALLERY_PAGE_SIZE = 5  # photos per /gallery page (one media group)
+GALLERY_API_MAX_LIMIT = 100
+# GET /gallery is off unless a key is set; callers send it as X-API-Key or ?key=
+GALLERY_API_KEY = os.getenv("GALLERY_API_KEY")
+GALLERY_API_KEY_BYTES = GALLERY_API_KEY.encode("utf-8") if GALLERY_API_KEY else None
+
+# Image store: delivered images kept on disk by SHA-256 and served from GET /images/<digest>,
+# so the gallery doesn't depend on expiring Replicate URLs. Least recently used images are
+# deleted once the store passes IMAGE_STORE_MAX_MB.
+IMAGE_STORE_PATH = os.getenv("IMAGE_STORE_PATH", "image_store")
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_MB", 2048)) * 1024 * 1024
+IMAGE_STORE = ImageStore(IMAGE_STORE_PATH, max_bytes=IMAGE_STORE_MAX_BYTES, max_image_bytes=IMAGE_DOWNLOAD_MAX_BYTES)
+IMAGE_STORE.load()
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"  # content-addressed, never changes
+ARCHIVE_TASKS = set()  # images being stored after delivery; given a few seconds to finish at shutdown
+
+TEXT_OVERLAY = TextOverlayRenderer(image_workers, TEXT_OVERLAY_FONT)
+PALETTE_ANALYZER = PaletteAnalyzer(image_workers, fetch_image)  # dominant colors of character images
+
+async def generate_pooled_image(prompt, owner):
+    return await generate_image(prompt, owner=owner)
+
+WARM_POOL = WarmPool(
+    generate_pooled_image,
+    CHAT_THEMES.get,
+    lambda: IMAGE_ROUTER.is_idle(),
+    per_chat_size=2,  # ready memes kept per chat
+    global_size=20,  # ready memes kept across all chats
+    hourly_budget=30,  # pre-generations per hour, all chats
+    per_chat_hourly_budget=6,  # pre-generations per hour, per chat
+    active_window=3600,  # seconds since a chat's last /SUIMEME before it stops being filled
+    render_options={'text_in_image': not TEXT_OVERLAY_ENABLED}
+)
+
+# Event loop watchdog
+LOOP_LAG_THRESHOLD = 0.25  # seconds of blocking before the loop thread stack is captured
+LOOP_DEBUG = os.getenv("LOOP_DEBUG", "false").lower() == "true"  # asyncio slow-callback reporting
+LOOP_WATCHDOG = LoopWatchdog(interval=0.5, threshold=LOOP_LAG_THRESHOLD, debug=LOOP_DEBUG)
+
+# Image backends: IMAGE_BACKEND=replicate (default) or stub for offline runs
+IMAGE_BACKEND = os.getenv("IMAGE_BACKEND", "replicate").lower()
+IMAGE_ROUTING = os.getenv("IMAGE_ROUTING", "failover").lower()  # "failover" or "balance"
+REPLICATE_FALLBACK_VERSION = os.getenv("REPLICATE_FALLBACK_VERSION")  # optional second model version
+REPLICATE_FAST_VERSION = os.getenv("REPLICATE_FAST_VERSION")  # optional distilled model, used only under load
+IMAGE_QUEUE_TIMEOUT = 30  # max seconds a request waits for a concurrency slot
+IMAGE_WAIT_TIMEOUT = 120  # max seconds to wait for a prediction
+IMAGE_BREAKER_OPTIONS = {
+    'window': 120,  # seconds of history used for error/slow rates
+    'min_calls': 5,  # calls in window before the breaker may trip
+    'error_rate': 0.5,  # trip when half the calls fail
+    'slow_call_rate': 0.5,  # or when half the calls are slow
+    'slow_call_seconds': 90,
+    'open_seconds': 30  # fail fast this long before a half-open trial
+}
+IMAGE_LIMITER_OPTIONS = {
+    'initial_limit': 4,
+    'min_limit': 1,
+    'max_limit': 16,
+    'target_latency': 45,  # seconds; slower calls shrink the limit
+    'max_queue': 20  # waiting requests beyond this are shed immediately
+}
+
+def build_image_router():
+    if IMAGE_BACKEND == "stub":
+        backends = [LocalStubBackend(latency=float(os.getenv("STUB_LATENCY", 1)))]
+    else:
+        backends = [ReplicateBackend(REPLICATE_API_TOKEN, SDXL_VERSION, name="replicate-sdxl")]
+        if REPLICATE_FALLBACK_VERSION:
+            backends.append(ReplicateBackend(REPLICATE_API_TOKEN, REPLICATE_FALLBACK_VERSION, name="replicate-fallback"))
+        if REPLICATE_FAST_VERSION:
+            backends.append(ReplicateBackend(REPLICATE_API_TOKEN, REPLICATE_FAST_VERSION, name="replicate-fast", on_demand=True))
+    return BackendRouter(
+        backends,
+        strategy=IMAGE_ROUTING,
+        queue_timeout=IMAGE_QUEUE_TIMEOUT,
+        wait_timeout=IMAGE_WAIT_TIMEOUT,
+        breaker_options=IMAGE_BREAKER_OPTIONS,
+        limiter_options=IMAGE_LIMITER_OPTIONS
+    )
+
+IMAGE_ROUTER = build_image_router()
+
+# Quality profiles, full quality first; each one is used while load stays within its limits
+QUALITY_PROFILES = [
+    QualityProfile("full", max_depth=4, max_latency=40),
+    QualityProfile("reduced", {'num_inference_steps': 25}, max_depth=8, max_latency=60),
+    QualityProfile("fast", {'num_inference_steps': 15, 'width': 768, 'height': 768}, max_depth=16)
+]
+if IMAGE_ROUTER.route_for("replicate-fast") is not None:
+    QUALITY_PROFILES.append(QualityProfile("distilled", backend="replicate-fast"))
+QUALITY_POLICY = QualityPolicy(
+    QUALITY_PROFILES,
+    lambda: (IMAGE_ROUTER.queue_depth(), IMAGE_ROUTER.primary_latency()),
+    recover_after=60  # seconds of low load before stepping back up a profile
+)
 
 # Placeholder for searching an image URL
 async def search_image_url(ticker):
@@ -120,39 +316,92 @@ async def search_image_url(ticker):
         logger.error(f"Error searching image URL for {ticker}: {str(e)}")
         return None
 
-# Placeholder for image analysis
+# Theme vocabularies for a character image; colors come from the image's actual palette
 async def analyze_image_from_url(image_url):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(image_url)
-            if response.status_code != 200:
-                logger.error(f"Failed to fetch image from {image_url}: {response.status_code}")
-                return None
-            if "toilet" in image_url.lower():
-                return {
-                    'objects': ["a golden toilet", "a pile of toilet paper", "a plunger", "a toilet brush"],
-                    'styles': ["toilet paper aesthetic", "grungy bathroom vibe"],
-                    'scenes': ["sewer explosion", "toilet flush storm"],
-                    'colors': ["poop brown", "toilet blue", "slime green"]
-                }
-            elif "lofi" in image_url.lower():
-                return {
-                    'objects': ["a chill record player", "a stack of vinyl records", "a retro lamp"],
-                    'styles': ["lofi aesthetic", "vaporwave style"],
-                    'scenes': ["vaporwave sunset", "chill night city"],
-                    'colors': ["pastel purple", "neon pink", "soft blue"]
-                }
-            else:
-                return {
-                    'objects': random.sample(DEFAULT_OBJECTS, 4),
-                    'styles': random.sample(DEFAULT_STYLES, 2),
-                    'scenes': random.sample(DEFAULT_SCENES, 2),
-                    'colors': random.sample(DEFAULT_COLORS, 3)
-                }
+        colors = await PALETTE_ANALYZER.colors_for_url(image_url) if palette.available() else None
+        if "toilet" in image_url.lower():
+            return {
+                'objects': ["a golden toilet", "a pile of toilet paper", "a plunger", "a toilet brush"],
+                'styles': ["toilet paper aesthetic", "grungy bathroom vibe"],
+                'scenes': ["sewer explosion", "toilet flush storm"],
+                'colors': colors or ["poop brown", "toilet blue", "slime green"]
+            }
+        elif "lofi" in image_url.lower():
+            return {
+                'objects': ["a chill record player", "a stack of vinyl records", "a retro lamp"],
+                'styles': ["lofi aesthetic", "vaporwave style"],
+                'scenes': ["vaporwave sunset", "chill night city"],
+                'colors': colors or ["pastel purple", "neon pink", "soft blue"]
+            }
+        else:
+            return {
+                'objects': random.sample(VOCABULARY.current['objects'], 4),
+                'styles': random.sample(VOCABULARY.current['styles'], 2),
+                'scenes': random.sample(VOCABULARY.current['scenes'], 2),
+                'colors': colors or random.sample(VOCABULARY.current['colors'], 3)
+            }
     except Exception as e:
         logger.error(f"Error analyzing image from {image_url}: {str(e)}")
         return None
 
+# Build (or rebuild) a chat's compiled theme; call whenever its settings or character image change
+async def build_chat_theme(chat_id, chat_settings):
+    vocab = VOCABULARY.current
+    character_image = chat_settings.character_image
+    if character_image and validators.url(character_image):
+        image_theme = await analyze_image_from_url(character_image)
+        if image_theme:
+            vocab = image_theme
+    theme = Theme(
+        vocab['objects'], vocab['styles'], vocab['scenes'], vocab['colors'],
+        chat_settings.main_character, chat_settings.ticker
+    )
+    CHAT_THEMES[chat_id] = theme
+    WARM_POOL.invalidate(chat_id)
+    logger.info(f"Built theme for chat {chat_id}")
+    return theme
+
+async def get_chat_theme(chat_id, chat_settings):
+    theme = CHAT_THEMES.get(chat_id)
+    if theme is None:
+        theme = await build_chat_theme(chat_id, chat_settings)
+    return theme
+
+def get_chat_settings(chat_id):
+    chat_settings = CHAT_SETTINGS.get(chat_id)
+    if chat_settings is None:
+        chat_settings = CHAT_SETTINGS[chat_id] = ChatSettings()
+    return chat_settings
+
+# Look up the character image for the chat's ticker once
+async def ensure_character_image(chat_settings):
+    if not chat_settings.image_searched:
+        image_url = await search_image_url(chat_settings.ticker)
+        chat_settings.set('character_image', image_url if image_url else None)
+        save_chat_settings_soon()
+
+async def write_all_chat_settings():
+    if SETTINGS_SAVE['lock'] is None:
+        SETTINGS_SAVE['lock'] = asyncio.Lock()
+    async with SETTINGS_SAVE['lock']:
+        data = {chat_id: chat_settings.to_dict() for chat_id, chat_settings in CHAT_SETTINGS.items()}
+        try:
+            await asyncio.to_thread(write_chat_settings, CHAT_SETTINGS_PATH, data)
+        except OSError as e:
+            logger.error(f"Failed to save chat settings: {str(e)}")
+
+async def delayed_settings_save():
+    await asyncio.sleep(SETTINGS_SAVE_DELAY)
+    # Cleared before the snapshot, so changes made during the write schedule another one
+    SETTINGS_SAVE['task'] = None
+    await write_all_chat_settings()
+
+# Persist CHAT_SETTINGS shortly, coalescing bursts of changes into one write
+def save_chat_settings_soon():
+    if SETTINGS_SAVE['task'] is None:
+        SETTINGS_SAVE['task'] = asyncio.create_task(delayed_settings_save())
+
 # Retry decorator
 def retry_on_timeout(retries=3, delay=1):
     def decorator(func):
@@ -243,98 +492,108 @@ async def search_term(term):
         logger.error(f"Search failed for {term}: {str(e)}")
         return term
 
-def generate_meme_prompt(description=None, scene=None, custom_text=None, color=None, additional_characters=None, theme=None, chat_data=None):
-    main_character = chat_data.get('main_character', "Blue Slime King")
-    theme = theme or {
-        'objects': DEFAULT_OBJECTS,
-        'styles': DEFAULT_STYLES,
-        'scenes': DEFAULT_SCENES,
-        'colors': DEFAULT_COLORS
-    }
-
-    objects = theme['objects']
-    styles = theme['styles']
-    scenes = theme['scenes']
-    colors = theme['colors']
-
-    selected_color = color if color in colors else random.choice(colors)
-    selected_scene = scene if scene in scenes else random.choice(scenes)
-    object_sitting = random.choice(objects)
-    style = random.choice(styles)
-    ticker = chat_data.get('ticker', '$SUIMEME')
-
-    base_prompt = f"A {style} illustration of {main_character}"
-    if additional_characters:
-        base_prompt += f" with {', '.join(additional_characters)}"
-    if description:
-        base_prompt += f" {description}"
+def generate_meme_prompt(description=None, scene=None, custom_text=None, color=None, additional_characters=None, theme=None, chat_settings=None, object_sitting=None, seed=None, text_in_image=True):
+    if isinstance(theme, Theme):
+        template = theme.template
     else:
-        base_prompt += f" sitting confidently on {object_sitting}"
-    base_prompt += f", with a golden crown and {ticker} symbol"
-    if selected_scene:
-        base_prompt += f", in a dramatic {selected_scene} setting"
-    if selected_color:
-        base_prompt += f", colored in vibrant {selected_color}"
-    if custom_text:
-        base_prompt += f", with the text '{custom_text}' prominently displayed on the image"
-    base_prompt += ", vibrant, humorous, high-quality, meme-inspired"
-    logger.info(f"Generated prompt: {base_prompt}")
-    return base_prompt
-
-async def generate_image(prompt):
+        theme = theme or VOCABULARY.current
+        chat_settings = chat_settings or ChatSettings()
+        template = compile_template(chat_settings.main_character, chat_settings.ticker, theme)
+    prompt = template.render(description, scene, custom_text, color, additional_characters, object_sitting, seed, text_in_image)
+    logger.info(f"Generated prompt (seed {seed}): {prompt}")
+    return prompt
+
+# Photo to send for a generated image: the URL itself, or JPEG bytes with the text drawn on
+async def overlay_photo(image_url, custom_text, ticker):
+    if not TEXT_OVERLAY_ENABLED:
+        return image_url
+    try:
+        image_bytes = await fetch_image(image_url)
+        start_time = time.monotonic()
+        photo = await TEXT_OVERLAY.render(image_bytes, custom_text, ticker)
+        metrics.observe("overlay.latency", time.monotonic() - start_time)
+        return photo
+    except Exception as e:
+        logger.error(f"Text overlay failed for {image_url}: {str(e)}")
+        metrics.inc("overlay.failed")
+        return image_url
+
+# Store the image that was sent (overlay bytes, or the upstream URL streamed to disk) and
+# record it in the gallery; runs in the background after delivery
+async def archive_meme(sent, image_url, chat_id, prompt, **fields):
+    digest = None
+    try:
+        if isinstance(sent, bytes):
+            digest = await IMAGE_STORE.put(sent)
+        else:
+            digest = await IMAGE_STORE.put_url(image_url, download_client())
+    except (httpx.HTTPError, OSError, ValueError) as e:
+        logger.error(f"Failed to store image {image_url}: {str(e)}")
+        metrics.inc("image_store.failed")
+    GALLERY.record(chat_id, prompt, image_url=image_url, image_digest=digest, **fields)
+
+# Archive a delivered meme and index it for inline mode; memes from private chats are only
+# ever shown back to that chat
+def remember_meme(message, caption, prompt, image_url, user_id=None, ticker=None, sent=None, **parsed):
+    if message is None or not message.photo:
+        return
+    photo = message.photo[-1]
+    task = asyncio.create_task(archive_meme(
+        sent, image_url, message.chat_id, prompt, chat_type=message.chat.type, user_id=user_id,
+        ticker=ticker, file_id=photo.file_id, **parsed
+    ))
+    ARCHIVE_TASKS.add(task)
+    task.add_done_callback(ARCHIVE_TASKS.discard)
+    if message.chat.type != ChatType.PRIVATE:
+        MEME_INDEX.add(photo.file_unique_id, photo.file_id, caption)
+
+def progress_text(ticker, stage, percent=None):
+    if stage == "queued":
+        return f"Generating your {ticker} meme\n⏳ Queued, you're number {percent} in line"
+    if stage == "starting":
+        return f"Generating your {ticker} meme\n🔥 Warming up the meme machine"
+    if percent is not None:
+        return f"Generating your {ticker} meme\n🎨 Painting... {percent}%"
+    return f"Generating your {ticker} meme\n🎨 Painting..."
+
+async def generate_image(prompt, owner=None, on_submit=None, on_progress=None, profile=None):
+    profile = profile or QUALITY_POLICY.choose()
+    start_time = time.monotonic()
     try:
-        url = "https://api.replicate.com/v1/predictions"
-        headers = {
-            "Authorization": f"Token {REPLICATE_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "version": "stability-ai/sdxl:39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b",
-            "input": {"prompt": prompt}
-        }
-        logger.info(f"Sending request to Replicate API with prompt: {prompt}")
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(url, headers=headers, json=data)
-            if response.status_code == 429:
-                logger.error("Replicate API rate limit exceeded")
-                return None, "Rate limit exceeded, please try again later"
-            if response.status_code != 201:
-                logger.error(f"Replicate API error: {response.status_code} - {response.text}")
-                return None, f"Replicate API error: {response.status_code} - {response.text}"
-            
-            prediction = response.json()
-            prediction_id = prediction.get("id")
-            if not prediction_id:
-                logger.error("No prediction ID in response")
-                return None, "Failed to get prediction ID"
-            logger.info(f"Prediction ID: {prediction_id}")
-            
-            max_wait_time = 120
-            start_time = time.time()
-            while time.time() - start_time < max_wait_time:
-                status_response = await client.get(f"{url}/{prediction_id}", headers=headers)
-                if status_response.status_code != 200:
-                    logger.error(f"Status check error: {status_response.status_code} - {status_response.text}")
-                    return None, f"Status check error: {status_response.status_code}"
-                result = status_response.json()
-                if result["status"] in ["succeeded", "failed", "canceled"]:
-                    break
-                await asyncio.sleep(1)
-            else:
-                logger.error("Replicate API took too long to respond")
-                return None, "Image generation timed out"
-            
-            if result["status"] == "succeeded" and "output" in result and result["output"]:
-                logger.info("Image generation succeeded")
-                return result["output"][0], None
-            logger.error(f"Image generation failed: {result.get('error', 'Unknown error')}")
-            return None, f"Image generation failed: {result.get('error', 'Unknown error')}"
-    except httpx.TimeoutException as e:
-        logger.error(f"Replicate API timeout: {str(e)}")
-        return None, f"Replicate API timeout: {str(e)}"
+        image_url, error = await IMAGE_ROUTER.generate(
+            prompt, owner=owner, on_submit=on_submit, on_progress=on_progress,
+            prefer=profile.backend, **profile.options
+        )
     except Exception as e:
         logger.error(f"Unexpected error in generate_image: {str(e)}")
-        return None, f"Unexpected error: {str(e)}"
+        image_url, error = None, f"Unexpected error: {str(e)}"
+    if error != PREDICTION_REPLACED:
+        QUALITY_POLICY.record(profile, time.monotonic() - start_time, error is None)
+    return image_url, error
+
+# Holder gate check for gated groups; replies and returns False when the user may not proceed
+async def check_holder_gate(update, chat_settings):
+    if chat_settings.min_holding is None or update.effective_chat.type not in ["group", "supergroup"]:
+        return True
+    user_id = update.effective_user.id
+    coin_type = chat_settings.contract_address
+    state = HOLDER_GATE.status(user_id, coin_type, chat_settings.min_holding)
+    if state == HOLDER_OK:
+        return True
+    metrics.inc(f"holder_gate.denied.{state}")
+    if state == HOLDER_UNKNOWN:
+        # First use (or a lapsed result): never wait on Sui here, the background sweep checks it
+        HOLDER_GATE.enqueue(user_id, coin_type)
+        await update.message.reply_text("Yo, slime fam! 🔍 Verifying your bag on Sui, try again shortly! 💦")
+    elif state == HOLDER_UNLINKED:
+        await update.message.reply_text(
+            f"Yo, slime fam! 👑 This group is for {chat_settings.ticker} holders. DM me /link <your Sui address> to get in! 💦"
+        )
+    else:
+        await update.message.reply_text(
+            f"Yo, slime fam! 👑 You need at least {chat_settings.min_holding:,g} {chat_settings.ticker} in your linked wallet to use me here! 💦"
+        )
+    return False
 
 @retry_on_timeout(retries=3, delay=1)
 async def suimeme(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -345,65 +604,78 @@ async def suimeme(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     key = f"{chat_id}_{user_id}"
     current_time = time.time()
+    chat_settings = get_chat_settings(chat_id)
+    if not await check_holder_gate(update, chat_settings):
+        return
 
-    # Check if user is already processing a request
-    if ACTIVE_REQUESTS.get(key, False):
-        ticker = context.chat_data.get('ticker', '$SUIMEME')
+    # Check if user is already processing a request; one already waiting on the
+    # image backend gets replaced (and its prediction cancelled) instead
+    replacing = bool(ACTIVE_REQUESTS.get(key, False)) and IMAGE_ROUTER.registry.has_owner(key)
+    if ACTIVE_REQUESTS.get(key, False) and not replacing:
+        ticker = chat_settings.ticker
         await update.message.reply_text(
             f"Yo, slime fam! 😎 Hold on, you're spamming too fast! Wait for your current {ticker} meme to finish! 💦"
         )
         logger.info(f"User {user_id} in chat {chat_id} has active request, blocked")
         return
 
-    try:
-        ACTIVE_REQUESTS[key] = True
+    # Rate limits and cooldown come before claiming the request slot: a replacement that is
+    # turned away here must not release the slot the running request still holds. None of
+    # these checks yields before passing, so nothing can claim the slot in between.
+    # Check per-user rate limit
+    user_ok, _ = await check_user_rate_limit(chat_id, user_id)
+    if not user_ok:
+        ticker = chat_settings.ticker
+        await update.message.reply_text(
+            f"Yo, slime fam! 😎 You're going too fast! Wait a bit for the next {ticker} meme drop! 💦"
+        )
+        logger.info(f"User rate limit hit for {key}")
+        return
 
-        # Check per-user rate limit
-        user_ok, _ = await check_user_rate_limit(chat_id, user_id)
-        if not user_ok:
-            ticker = context.chat_data.get('ticker', '$SUIMEME')
-            await update.message.reply_text(
-                f"Yo, slime fam! 😎 You're going too fast! Wait a bit for the next {ticker} meme drop! 💦"
-            )
-            logger.info(f"User rate limit hit for {key}")
-            return
+    # Check global rate limit
+    if not await check_global_rate_limit(context):
+        ticker = chat_settings.ticker
+        await update.message.reply_text(
+            f"Yo, slime fam! 😎 The bot's too hot right now! 🔥 Wait a bit for the next {ticker} meme drop! 💦"
+        )
+        logger.info(f"Global rate limit hit for chat {chat_id}")
+        return
 
-        # Check global rate limit
-        if not await check_global_rate_limit(context):
-            ticker = context.chat_data.get('ticker', '$SUIMEME')
-            await update.message.reply_text(
-                f"Yo, slime fam! 😎 The bot's too hot right now! 🔥 Wait a bit for the next {ticker} meme drop! 💦"
-            )
-            logger.info(f"Global rate limit hit for chat {chat_id}")
-            return
+    # Check cooldown
+    last_request_time = COOLDOWN_STORAGE.get(key, 0)
+    time_since_last = current_time - last_request_time
+    logger.info(f"User {user_id} in chat {chat_id}, time since last: {time_since_last:.3f}s, cooldown: {SUIMEME_COOLDOWN}s")
+    if time_since_last < SUIMEME_COOLDOWN or time_since_last < MIN_REQUEST_GAP:
+        cooldown_left = SUIMEME_COOLDOWN - time_since_last if time_since_last < SUIMEME_COOLDOWN else MIN_REQUEST_GAP - time_since_last
+        ticker = chat_settings.ticker
+        await update.message.reply_text(
+            f"Yo, slime fam! 😎 Hold on, you're spamming too fast! Wait {cooldown_left:.1f}s for the next {ticker} meme drop! 💦"
+        )
+        logger.info(f"User {user_id} in chat {chat_id} is on cooldown, {cooldown_left:.1f}s remaining")
+        return
 
-        # Check cooldown
-        last_request_time = COOLDOWN_STORAGE.get(key, 0)
-        time_since_last = current_time - last_request_time
-        logger.info(f"User {user_id} in chat {chat_id}, time since last: {time_since_last:.3f}s, cooldown: {SUIMEME_COOLDOWN}s")
-        if time_since_last < SUIMEME_COOLDOWN or time_since_last < MIN_REQUEST_GAP:
-            cooldown_left = SUIMEME_COOLDOWN - time_since_last if time_since_last < SUIMEME_COOLDOWN else MIN_REQUEST_GAP - time_since_last
-            ticker = context.chat_data.get('ticker', '$SUIMEME')
-            await update.message.reply_text(
-                f"Yo, slime fam! 😎 Hold on, you're spamming too fast! Wait {cooldown_left:.1f}s for the next {ticker} meme drop! 💦"
-            )
-            logger.info(f"User {user_id} in chat {chat_id} is on cooldown, {cooldown_left:.1f}s remaining")
-            return
+    # Update cooldown
+    COOLDOWN_STORAGE[key] = current_time
+    logger.info(f"Updated cooldown timestamp for {key}: {current_time}")
 
-        # Update cooldown
-        COOLDOWN_STORAGE[key] = current_time
-        logger.info(f"Updated cooldown timestamp for {key}: {current_time}")
-
-        # Initialize default settings
-        if 'main_character' not in context.chat_data:
-            context.chat_data['main_character'] = "Blue Slime King"
-            context.chat_data['characters'] = ["Blue Slime King"]
-        if 'ticker' not in context.chat_data:
-            context.chat_data['ticker'] = "$SUIMEME"
-        if 'character_image' not in context.chat_data:
-            ticker = context.chat_data['ticker']
-            image_url = await search_image_url(ticker)
-            context.chat_data['character_image'] = image_url if image_url else None
+    request_token = object()
+    try:
+        ACTIVE_REQUESTS[key] = request_token
+
+        await ensure_character_image(chat_settings)
+
+        # Argument-less requests are served straight from the warm pool when it has one ready
+        if WARM_POOL_ENABLED:
+            WARM_POOL.mark_active(chat_id)
+            pooled = WARM_POOL.take(chat_id) if not context.args else None
+            if pooled:
+                prompt, image_url = pooled
+                logger.info(f"Serving pooled meme to {key}: {image_url}")
+                caption = f"{chat_settings.ticker} Meme: {prompt}"
+                photo = await overlay_photo(image_url, None, chat_settings.ticker)
+                message = await update.message.reply_photo(photo=photo, caption=caption)
+                remember_meme(message, caption, prompt, image_url, user_id, chat_settings.ticker, photo)
+                return
 
         # Send typing action
         await update.message.chat.send_action(ChatAction.TYPING)
@@ -424,22 +696,8 @@ async def suimeme(update: Update, context: ContextTypes.DEFAULT_TYPE):
         additional_characters = []
         object_sitting = None
 
-        # Process input and handle image theme
-        theme = {
-            'objects': DEFAULT_OBJECTS,
-            'styles': DEFAULT_STYLES,
-            'scenes': DEFAULT_SCENES,
-            'colors': DEFAULT_COLORS
-        }
-        character_image = context.chat_data.get('character_image', None)
-        if character_image and validators.url(character_image):
-            image_theme = await analyze_image_from_url(character_image)
-            if image_theme:
-                theme = image_theme
-
-        scenes = theme['scenes']
-        colors = theme['colors']
-        objects = theme['objects']
+        # Compiled per-chat theme, rebuilt only when settings change
+        theme = await get_chat_theme(chat_id, chat_settings)
 
         # Process input
         if user_input:
@@ -450,62 +708,100 @@ async def suimeme(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 description_input = description_input.strip()
 
             terms = description_input.split()
-            main_character = context.chat_data.get('main_character', 'Blue Slime King').lower()
+            main_character = chat_settings.main_character.lower()
 
             for term in terms:
                 term_lower = term.lower()
-                found_scene = False
-                for s in scenes:
-                    if re.search(rf'\b{s}\b', term_lower, re.IGNORECASE) or term_lower == 'moon':
-                        scene = term_lower if term_lower == 'moon' else s
-                        found_scene = True
-                        description_input = re.sub(rf'\b{term_lower}\b', '', description_input, flags=re.IGNORECASE).strip()
-                        break
-                if found_scene:
+                match = theme.match_term(term_lower)
+                if match is None:
+                    if term_lower != main_character:
+                        searched_term = await search_term(term)
+                        if searched_term != term:
+                            additional_characters.append(searched_term)
+                        else:
+                            description = term if not description else f"{description} {term}"
                     continue
-                for c in colors:
-                    if re.search(rf'\b{c}\b', term_lower, re.IGNORECASE):
-                        color = c
-                        description_input = re.sub(rf'\b{term_lower}\b', '', description_input, flags=re.IGNORECASE).strip()
-                        break
+                kind, value = match
+                if kind == 'scene':
+                    scene = value
+                elif kind == 'color':
+                    color = value
                 else:
-                    for obj in objects:
-                        obj_name = obj.replace('a ', '').replace('an ', '').lower()
-                        if term_lower in obj_name or term_lower == 'rocketship':
-                            object_sitting = obj if term_lower in obj_name else 'a rocket ship'
-                            description_input = re.sub(rf'\b{term_lower}\b', '', description_input, flags=re.IGNORECASE).strip()
-                            break
-                    else:
-                        if term_lower != main_character:
-                            searched_term = await search_term(term)
-                            if searched_term != term:
-                                additional_characters.append(searched_term)
-                            else:
-                                description = term if not description else f"{description} {term}"
+                    object_sitting = value
+                description_input = re.sub(rf'\b{re.escape(term_lower)}\b', '', description_input, flags=re.IGNORECASE).strip()
 
             description_input = description_input.strip()
             if description_input and description_input.lower() != main_character:
                 description = description_input
             logger.info(f"Parsed - Description: {description}, Scene: {scene}, Color: {color}, Custom Text: {custom_text}, Additional Characters: {additional_characters}, Object: {object_sitting}")
 
-        ticker = context.chat_data.get('ticker', '$SUIMEME')
-        await update.message.reply_text(f"Generating your {ticker} meme")
-        prompt = generate_meme_prompt(description, scene, custom_text, color, additional_characters, theme, context.chat_data)
-        if object_sitting:
-            prompt = prompt.replace(f"sitting confidently on {random.choice(objects)}", f"sitting confidently on {object_sitting}")
-        image_url, error = await generate_image(prompt)
+        ticker = chat_settings.ticker
+        if IMAGE_ROUTER.is_open():
+            await update.message.reply_text(
+                f"Yo, slime fam! 😅 The meme machine is cooling down. Try your {ticker} meme again in {max(1, int(IMAGE_ROUTER.retry_after()))}s! 💦"
+            )
+            logger.info(f"All image backends open, rejected request from {key}")
+            return
+        status = STATUS_EDITS.track(await update.message.reply_text(f"Generating your {ticker} meme"))
+        prompt = generate_meme_prompt(
+            description, scene, custom_text, color, additional_characters, theme, chat_settings,
+            object_sitting, new_seed(), text_in_image=not TEXT_OVERLAY_ENABLED
+        )
+        if replacing and await IMAGE_ROUTER.registry.replace(key):
+            logger.info(f"Replaced in-flight prediction for {key}")
+        caption = f"{ticker} Meme: {prompt}"
+        profile = QUALITY_POLICY.choose()
+        logger.info(f"Generating for {key} with quality profile {profile.name}")
+        job_id = await GENERATION_JOURNAL.accept(
+            chat_id, user_id, update.message.message_id, prompt, caption, profile.name,
+            custom_text=custom_text if TEXT_OVERLAY_ENABLED else None,
+            ticker=ticker if TEXT_OVERLAY_ENABLED else None
+        )
+
+        async def journal_submission(prediction):
+            await GENERATION_JOURNAL.set_prediction(job_id, prediction.backend.name, prediction.id)
+
+        async def show_progress(stage, percent):
+            status.update(progress_text(ticker, stage, percent))
+
+        try:
+            image_url, error = await generate_image(
+                prompt, owner=key, on_submit=journal_submission, on_progress=show_progress, profile=profile
+            )
+        finally:
+            await status.close()
+        if error in (None, PREDICTION_REPLACED):
+            # The photo (or the newer request's status) takes over
+            try:
+                await status.message.delete()
+            except TelegramError as e:
+                logger.warning(f"Failed to delete status message for {key}: {str(e)}")
+        if error == PREDICTION_REPLACED:
+            logger.info(f"Request from {key} was replaced by a newer one")
+            await GENERATION_JOURNAL.finish(job_id, CANCELLED)
+            return
         if error:
             logger.error(f"Failed to generate image: {error}")
+            await GENERATION_JOURNAL.finish(job_id, FAILED)
             await update.message.reply_text(f"Oops, failed to generate meme: {error}")
             return
         logger.info(f"Successfully generated image: {image_url}")
-        await update.message.reply_photo(
-            photo=image_url,
-            caption=f"{ticker} Meme: {prompt}"
+        try:
+            photo = await overlay_photo(image_url, custom_text, ticker)
+            message = await update.message.reply_photo(photo=photo, caption=caption)
+        except Exception:
+            await GENERATION_JOURNAL.finish(job_id, FAILED)
+            raise
+        await GENERATION_JOURNAL.finish(job_id, DELIVERED)
+        remember_meme(
+            message, caption, prompt, image_url, user_id, ticker, photo,
+            description=description, scene=scene, color=color, custom_text=custom_text, object=object_sitting,
+            characters=", ".join(additional_characters) or None
         )
 
     finally:
-        ACTIVE_REQUESTS[key] = False
+        if ACTIVE_REQUESTS.get(key) is request_token:
+            ACTIVE_REQUESTS[key] = False
         logger.info(f"Released active request lock for {key}")
 
 @retry_on_timeout(retries=3, delay=1)
@@ -515,7 +811,7 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"/settings from {user_id} in chat {chat_id}")
 
     if not await is_user_admin(update, context):
-        ticker = context.chat_data.get('ticker', '$SUIMEME')
+        ticker = get_chat_settings(chat_id).ticker
         await update.message.reply_text(
             f"Yo, slime fam! 😅 /settings is only for group admins. Ask an admin to customize the {ticker} vibe! 👑"
         )
@@ -525,42 +821,20 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.chat.send_action(ChatAction.TYPING)
     await asyncio.sleep(1)
 
-    if 'main_character' not in context.chat_data:
-        context.chat_data['main_character'] = "Blue Slime King"
-        context.chat_data['characters'] = ["Blue Slime King"]
-    if 'ticker' not in context.chat_data:
-        context.chat_data['ticker'] = "$SUIMEME"
-    if 'contract_address' not in context.chat_data:
-        context.chat_data['contract_address'] = "0xeded589fe72aef12b3b22a826723854820c8480023f3a0ef49460f8429b8d080::suimeme::SUIMEME"
-    if 'telegram' not in context.chat_data:
-        context.chat_data['telegram'] = "https://t.me/suimeme"
-    if 'twitter' not in context.chat_data:
-        context.chat_data['twitter'] = "https://x.com/sui_meme_sui/"
-    if 'website' not in context.chat_data:
-        context.chat_data['website'] = "https://sui-meme.com/"
-    if 'character_image' not in context.chat_data:
-        ticker = context.chat_data['ticker']
-        image_url = await search_image_url(ticker)
-        context.chat_data['character_image'] = image_url if image_url else None
-
-    main_character = context.chat_data.get('main_character', 'Blue Slime King')
-    character_image = context.chat_data.get('character_image', 'Not set')
-    contract_address = context.chat_data.get('contract_address', '0xeded589fe72aef12b3b22a826723854820c8480023f3a0ef49460f8429b8d080::suimeme::SUIMEME')
-    telegram = context.chat_data.get('telegram', 'https://t.me/suimeme')
-    twitter = context.chat_data.get('twitter', 'https://x.com/sui_meme_sui/')
-    website = context.chat_data.get('website', 'https://sui-meme.com/')
-    ticker = context.chat_data.get('ticker', '$SUIMEME')
+    chat_settings = get_chat_settings(chat_id)
+    await ensure_character_image(chat_settings)
 
     settings_text = (
         f"Yo, slime fam! 😎 Current settings for this group: 💦\n"
         f"------------------------\n"
-        f"Main Character: {main_character}\n"
-        f"Character Image: {character_image}\n"
-        f"Contract Address: {contract_address}\n"
-        f"Telegram: {telegram}\n"
-        f"Twitter/X: {twitter}\n"
-        f"Website: {website}\n"
-        f"Ticker: {ticker}\n"
+        f"Main Character: {chat_settings.main_character}\n"
+        f"Character Image: {chat_settings.character_image}\n"
+        f"Contract Address: {chat_settings.contract_address}\n"
+        f"Telegram: {chat_settings.telegram}\n"
+        f"Twitter/X: {chat_settings.twitter}\n"
+        f"Website: {chat_settings.website}\n"
+        f"Ticker: {chat_settings.ticker}\n"
+        f"Holder Gate: {'off' if chat_settings.min_holding is None else f'{chat_settings.min_holding:,g} {chat_settings.ticker}'}\n"
         f"------------------------\n"
         "Click a button below to update a setting:"
     )
@@ -579,7 +853,8 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
             InlineKeyboardButton("Website", callback_data='set_web')
         ],
         [
-            InlineKeyboardButton("Ticker", callback_data='set_ticker')
+            InlineKeyboardButton("Ticker", callback_data='set_ticker'),
+            InlineKeyboardButton("Holder Gate", callback_data='set_gate')
         ]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -594,7 +869,14 @@ async def hey(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.chat.send_action(ChatAction.TYPING)
     await asyncio.sleep(1)
     
-    await update.message.reply_text("Yo, slime fam! I'm not available to talk for now, but keep the $SUIMEME vibes flowin'! 💦")
+    reply = None
+    responder = RESPONSES.current
+    if responder is not None:
+        username = update.effective_user.first_name or update.effective_user.username or "slime fam"
+        intent, reply = responder.reply(" ".join(context.args or []), username)
+        metrics.inc(f"hey.intent.{intent}")
+        logger.info(f"/hey from {user_id} classified as {intent}")
+    await update.message.reply_text(reply or HEY_FALLBACK)
 
 @retry_on_timeout(retries=3, delay=1)
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -606,14 +888,15 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     setting = query.data
     
     if not await is_user_admin(update, context):
-        ticker = context.chat_data.get('ticker', '$SUIMEME')
+        ticker = get_chat_settings(chat_id).ticker
         await query.message.reply_text(
             f"Yo, slime fam! 😅 Only admins can update {ticker} settings. Ask an admin to make changes! 👑"
         )
         logger.info(f"User {user_id} in chat {chat_id} is not an admin, denied settings update")
         return
     
-    context.chat_data['current_setting_to_update'] = setting
+    get_chat_settings(chat_id).pending_setting = setting
+    PENDING_SETTINGS.add(chat_id)
     
     prompts = {
         'set_character': "Yo, slime fam! 😎 Enter the new character name (e.g., 'Fire Slime')",
@@ -622,7 +905,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'set_tg': "Yo, slime fam! 😎 Enter the new Telegram URL (e.g., 'https://t.me/newgroup')",
         'set_x': "Yo, slime fam! 😎 Enter the new Twitter/X URL (e.g., 'https://x.com/newaccount')",
         'set_web': "Yo, slime fam! 😎 Enter the new website URL (e.g., 'https://newwebsite.com')",
-        'set_ticker': "Yo, slime fam! 😎 Enter the new ticker (e.g., '$NEWCOIN')"
+        'set_ticker': "Yo, slime fam! 😎 Enter the new ticker (e.g., '$NEWCOIN')",
+        'set_gate': "Yo, slime fam! 😎 Enter the minimum tokens members must hold (e.g., '1000000'), or 0 to turn the gate off"
     }
     
     await query.message.reply_text(prompts.get(setting, "Yo, slime fam! 😎 Enter the new value"))
@@ -632,29 +916,30 @@ async def handle_setting_input(update: Update, context: ContextTypes.DEFAULT_TYP
     chat_id = update.message.chat_id
     user_id = update.effective_user.id
     
-    if 'current_setting_to_update' not in context.chat_data:
+    chat_settings = get_chat_settings(chat_id)
+    if chat_settings.pending_setting is None:
+        PENDING_SETTINGS.discard(chat_id)
         return
     
     if not await is_user_admin(update, context):
-        ticker = context.chat_data.get('ticker', '$SUIMEME')
+        ticker = chat_settings.ticker
         await update.message.reply_text(
             f"Yo, slime fam! 😅 Only admins can update {ticker} settings. Ask an admin to make changes! 👑"
         )
         logger.info(f"User {user_id} in chat {chat_id} is not an admin, denied setting input")
         return
     
-    setting = context.chat_data['current_setting_to_update']
+    setting = chat_settings.pending_setting
     new_value = update.message.text.strip()
     
     if setting == 'set_character':
-        context.chat_data['main_character'] = new_value
-        context.chat_data['characters'] = [new_value]
+        chat_settings.set('main_character', new_value)
         logger.info(f"Updated main character to {new_value} for chat {chat_id}")
         await update.message.reply_text(f"Yo, slime fam! Updated Main Character to {new_value} 💦")
     
     elif setting == 'set_image_url':
         if validators.url(new_value):
-            context.chat_data['character_image'] = new_value
+            chat_settings.set('character_image', new_value)
             logger.info(f"Updated character image to {new_value} for chat {chat_id}")
             await update.message.reply_text(f"Yo, slime fam! Updated Character Image to {new_value} 💦")
         else:
@@ -663,7 +948,7 @@ async def handle_setting_input(update: Update, context: ContextTypes.DEFAULT_TYP
     
     elif setting == 'set_ca':
         if re.match(r'0x[a-fA-F0-9]+::[a-zA-Z0-9]+::[a-zA-Z0-9]+', new_value):
-            context.chat_data['contract_address'] = new_value
+            chat_settings.set('contract_address', new_value)
             logger.info(f"Updated contract address to {new_value} for chat {chat_id}")
             await update.message.reply_text(f"Yo, slime fam! Updated Contract Address to {new_value} 💦")
         else:
@@ -672,7 +957,7 @@ async def handle_setting_input(update: Update, context: ContextTypes.DEFAULT_TYP
     
     elif setting == 'set_tg':
         if validators.url(new_value):
-            context.chat_data['telegram'] = new_value
+            chat_settings.set('telegram', new_value)
             logger.info(f"Updated Telegram to {new_value} for chat {chat_id}")
             await update.message.reply_text(f"Yo, slime fam! Updated Telegram to {new_value} 💦")
         else:
@@ -681,7 +966,7 @@ async def handle_setting_input(update: Update, context: ContextTypes.DEFAULT_TYP
     
     elif setting == 'set_x':
         if validators.url(new_value):
-            context.chat_data['twitter'] = new_value
+            chat_settings.set('twitter', new_value)
             logger.info(f"Updated Twitter/X to {new_value} for chat {chat_id}")
             await update.message.reply_text(f"Yo, slime fam! Updated Twitter/X to {new_value} 💦")
         else:
@@ -690,7 +975,7 @@ async def handle_setting_input(update: Update, context: ContextTypes.DEFAULT_TYP
     
     elif setting == 'set_web':
         if validators.url(new_value):
-            context.chat_data['website'] = new_value
+            chat_settings.set('website', new_value)
             logger.info(f"Updated website to {new_value} for chat {chat_id}")
             await update.message.reply_text(f"Yo, slime fam! Updated Website to {new_value} 💦")
         else:
@@ -699,25 +984,40 @@ async def handle_setting_input(update: Update, context: ContextTypes.DEFAULT_TYP
     
     elif setting == 'set_ticker':
         if re.match(r'\$[A-Z]+', new_value):
-            context.chat_data['ticker'] = new_value
+            chat_settings.set('ticker', new_value)
             logger.info(f"Updated ticker to {new_value} for chat {chat_id}")
             image_url = await search_image_url(new_value)
-            context.chat_data['character_image'] = image_url if image_url else None
+            chat_settings.set('character_image', image_url if image_url else None)
             await update.message.reply_text(f"Yo, slime fam! Updated Ticker to {new_value} 💦")
         else:
             await update.message.reply_text("Yo, slime! 😅 Invalid ticker. Try again with a valid ticker (e.g., '$NEWCOIN')")
             return
     
-    del context.chat_data['current_setting_to_update']
+    elif setting == 'set_gate':
+        try:
+            min_holding = float(new_value.replace(",", ""))
+        except ValueError:
+            min_holding = -1
+        if min_holding >= 0:
+            chat_settings.set('min_holding', min_holding or None)
+            logger.info(f"Updated holder gate to {min_holding} for chat {chat_id}")
+            status = f"at least {min_holding:,g} {chat_settings.ticker}" if min_holding else "off"
+            await update.message.reply_text(f"Yo, slime fam! Holder Gate is now {status} 💦")
+        else:
+            await update.message.reply_text("Yo, slime! 😅 Invalid amount. Try again with a number (e.g., '1000000'), or 0 to turn it off")
+            return
+    
+    if setting in ('set_character', 'set_image_url', 'set_ticker'):
+        await build_chat_theme(chat_id, chat_settings)
+    chat_settings.pending_setting = None
+    PENDING_SETTINGS.discard(chat_id)
+    save_chat_settings_soon()
 
 @retry_on_timeout(retries=3, delay=1)
 async def start_com(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.chat.send_action(ChatAction.TYPING)
     await asyncio.sleep(1)
-    if 'character_image' not in context.chat_data:
-        ticker = context.chat_data.get(' ticker', '$SUIMEME')
-        image_url = await search_image_url(ticker)
-        context.chat_data['character_image'] = image_url if image_url else None
+    await ensure_character_image(get_chat_settings(update.effective_chat.id))
     welcome = (
         "Yo, welcome to SuiMemeBot! 👑💦 I’m the Blue Slime King, droppin’ memes!\n\n"
         "/SUIMEME to make memes\n/how for tips\n/hey to vibe\n/settings to customize this group\n\n"
@@ -730,8 +1030,9 @@ async def start_com(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def how(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.chat.send_action(ChatAction.TYPING)
     await asyncio.sleep(1)
-    ticker = context.chat_data.get('ticker', '$SUIMEME')
-    main_character = context.chat_data.get('main_character', 'Blue Slime King')
+    chat_settings = get_chat_settings(update.effective_chat.id)
+    ticker = chat_settings.ticker
+    main_character = chat_settings.main_character
     help_text = (
         f"Wanna meme with {main_character}? Use /SUIMEME and describe it! 😎\n\n"
         "Add:\n- Scenes: explosion, fireworks, storm, wwe ring\n- Colors: red, blue, green\n"
@@ -742,13 +1043,129 @@ async def how(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(help_text)
 
+@retry_on_timeout(retries=3, delay=1)
+async def price(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_settings = get_chat_settings(update.effective_chat.id)
+    logger.info(f"/price from {update.effective_user.id} in chat {update.effective_chat.id}")
+    try:
+        info = await SUI_RPC.get_coin_info(chat_settings.contract_address)
+    except SuiRpcError as e:
+        logger.error(f"Failed to fetch coin info for {chat_settings.contract_address}: {str(e)}")
+        await update.message.reply_text(
+            f"Yo, slime fam! 😅 Couldn't reach the Sui chain for {chat_settings.ticker} right now. Try again in a bit! 💦"
+        )
+        return
+    supply = f"{info['supply']:,.0f}" if info['supply'] is not None else "unknown"
+    await update.message.reply_text(
+        f"Yo, slime fam! 📊 {info['name']} ({info['symbol']}) on Sui 💦\n"
+        f"Total supply: {supply}\n"
+        f"Decimals: {info['decimals']}\n"
+        f"Contract: {chat_settings.contract_address}"
+    )
+
+@retry_on_timeout(retries=3, delay=1)
+async def link(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    logger.info(f"/link from {user_id}")
+    pending = HOLDER_GATE.pending_challenge(user_id)
+    address = context.args[0].strip() if context.args else None
+    if pending is None and address is None:
+        await update.message.reply_text("Yo, slime fam! 😎 Send /link <your Sui address> to unlock holder-only groups 💦")
+        return
+    if address is not None and (pending is None or address.lower() != pending[0]):
+        # Proof of ownership: a random dust transfer only the address owner can send
+        error, amount = HOLDER_GATE.challenge(user_id, address)
+        if error:
+            await update.message.reply_text(f"Yo, slime! 😅 {error}")
+            return
+        await update.message.reply_text(
+            f"Yo, slime fam! 🔐 To prove the wallet is yours, send exactly {amount / MIST_PER_SUI:.9f} SUI "
+            f"from it to any other address (another wallet of yours works), then send /link again "
+            f"within {HOLDER_GATE.challenge_ttl // 60} minutes 💦"
+        )
+        return
+    try:
+        error = await HOLDER_GATE.confirm(user_id)
+    except SuiRpcError as e:
+        logger.error(f"Link confirmation for {user_id} failed: {str(e)}")
+        await update.message.reply_text("Yo, slime fam! 😅 Couldn't reach Sui right now. Send /link again in a bit! 💦")
+        return
+    if error:
+        await update.message.reply_text(f"Yo, slime! 😅 {error}")
+        return
+    await update.message.reply_text("Yo, slime fam! 🔗 Wallet linked! Holder-only groups will check your bag from now on 💦")
+
+# New members of gated groups get their balance checked in the background before their first command
+async def new_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_settings = CHAT_SETTINGS.get(update.effective_chat.id)
+    if chat_settings is None or chat_settings.min_holding is None:
+        return
+    for member in update.message.new_chat_members:
+        if not member.is_bot:
+            HOLDER_GATE.enqueue(member.id, chat_settings.contract_address)
+
+# @bot <words>: previously generated memes matching the words, newest first, paged via next_offset
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    try:
+        offset = max(0, int(query.offset or 0))
+    except ValueError:
+        offset = 0
+    start_time = time.monotonic()
+    entries, next_offset = MEME_INDEX.page(query.query, offset, INLINE_PAGE_SIZE)
+    metrics.observe("inline.lookup_latency", time.monotonic() - start_time)
+    results = [
+        InlineQueryResultCachedPhoto(id=key, photo_file_id=file_id, caption=caption[:1024])
+        for key, file_id, caption in entries
+    ]
+    try:
+        await query.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
+    except TelegramError as e:
+        # Usually the query expired while we were answering
+        logger.warning(f"Failed to answer inline query {query.query!r}: {str(e)}")
+        metrics.inc("inline.answer_failed")
+
+# Callback data is capped at 64 bytes, so a long query is cut short for the next pages
+def gallery_callback_data(cursor, text):
+    prefix = f"gallery:{cursor}:"
+    return prefix + text.encode("utf-8")[:64 - len(prefix)].decode("utf-8", "ignore")
+
+async def send_gallery_page(message, chat_id, text, before=None):
+    rows, next_cursor = await GALLERY.search(text, chat_id=chat_id, before=before, limit=GALLERY_PAGE_SIZE)
+    rows = [row for row in rows if row['file_id']]
+    if not rows:
+        ticker = get_chat_settings(chat_id).ticker
+        found = f" matching '{text}'" if text else ""
+        await message.reply_text(f"Yo, slime fam! 😅 No {ticker} memes{found} here yet. Make one with /SUIMEME! 💦")
+        return
+    await message.reply_media_group([
+        InputMediaPhoto(row['file_id'], caption=f"{row['ticker'] or ''} Meme: {row['prompt']}".strip()[:1024])
+        for row in rows
+    ])
+    if next_cursor is not None:
+        keyboard = [[InlineKeyboardButton("Older memes ➡️", callback_data=gallery_callback_data(next_cursor, text))]]
+        await message.reply_text("Want more? 👇", reply_markup=InlineKeyboardMarkup(keyboard))
+
+# /gallery [words]: this chat's memes, newest first, optionally full-text filtered by prompt
+@retry_on_timeout(retries=3, delay=1)
+async def gallery(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = " ".join(context.args or []).strip()
+    logger.info(f"/gallery from {update.effective_user.id} in chat {update.effective_chat.id}: {text}")
+    await send_gallery_page(update.message, update.effective_chat.id, text)
+
+async def gallery_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    _, cursor, text = query.data.split(":", 2)
+    await send_gallery_page(query.message, query.message.chat_id, text, before=int(cursor))
+
 @retry_on_timeout(retries=3, delay=1)
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.chat.send_action(ChatAction.TYPING)
     await asyncio.sleep(1)
-    ticker = context.chat_data.get('ticker', '$SUIMEME')
+    ticker = get_chat_settings(update.effective_chat.id).ticker
     await update.message.reply_text(
-        f"Yo! /SUIMEME for memes, /how for tips, /hey to vibe, /settings to customize this group’s {ticker} vibe, /start to join! 😎👑"
+        f"Yo! /SUIMEME for memes, /how for tips, /hey to vibe, /price for on-chain stats, /gallery to browse this group’s memes, type my @username plus a few words in any chat to share past memes, /settings to customize this group’s {ticker} vibe, /start to join! 😎👑"
     )
 
 @retry_on_timeout(retries=3, delay=1)
@@ -760,7 +1177,7 @@ async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.chat.send_action(ChatAction.TYPING)
     await asyncio.sleep(1)
-    ticker = context.chat_data.get('ticker', '$SUIMEME')
+    ticker = get_chat_settings(chat_id).ticker
     await update.message.reply_text(
         f"Yo, slime fam! 😅 Unknown command. Try /SUIMEME for memes, /how for tips, /hey to vibe, /settings for {ticker} group, or /start! 👑"
     )
@@ -778,35 +1195,253 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # FastAPI app for webhook mode
 app = FastAPI()
 
+# Optional fast serving mode: orjson body parsing, uvloop + httptools, tuned keep-alive/backlog.
+# Each piece falls back to the standard one when its package isn't installed.
+FAST_WEBHOOK = os.getenv("FAST_WEBHOOK", "false").lower() == "true"
+WEBHOOK_KEEPALIVE = 75  # seconds; Telegram reuses webhook connections
+WEBHOOK_BACKLOG = 4096  # pending TCP connections
+WEBHOOK_OK_BODY = b'{"status":"ok"}'
+WEBHOOK_MAX_BODY = 256 * 1024  # bytes; real updates are a few KB
+# Telegram echoes this in X-Telegram-Bot-Api-Secret-Token. Set it explicitly when running
+# several workers; otherwise each process registers its own random one at startup.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_SECRET_BYTES = WEBHOOK_SECRET.encode("utf-8")
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+def uvicorn_options(fast=None):
+    fast = FAST_WEBHOOK if fast is None else fast
+    if not fast:
+        return {}
+    options = {'timeout_keep_alive': WEBHOOK_KEEPALIVE, 'backlog': WEBHOOK_BACKLOG, 'access_log': False}
+    try:
+        import uvloop
+        options['loop'] = "uvloop"
+    except ImportError:
+        logger.warning("uvloop not installed, using the default event loop")
+    try:
+        import httptools
+        options['http'] = "httptools"
+    except ImportError:
+        logger.warning("httptools not installed, using h11")
+    return options
+
+# Background services shared by polling (post_init/post_shutdown) and webhook (FastAPI events) modes
+# Deliver a job a previous process accepted but never finished
+async def resume_journaled_job(application, job):
+    job_id = job['id']
+    if job['prediction_id'] is None:
+        # Never reached the backend, nothing to wait for
+        await GENERATION_JOURNAL.finish(job_id, FAILED)
+        return
+    if time.time() - job['created_at'] > JOURNAL_RESUME_MAX_AGE:
+        await GENERATION_JOURNAL.finish(job_id, EXPIRED)
+        return
+    logger.info(f"Resuming journaled job {job_id} (prediction {job['prediction_id']}) for chat {job['chat_id']}")
+    GENERATION_JOURNAL.submitted.add(job['prediction_id'])
+    image_url, error = await IMAGE_ROUTER.resume(job['backend'], job['prediction_id'], job['prompt'])
+    if error:
+        logger.error(f"Resumed job {job_id} failed: {error}")
+        await GENERATION_JOURNAL.finish(job_id, FAILED)
+        return
+    photo = image_url
+    if job['ticker'] is not None:
+        # The prompt left the text out; draw it like the original request would have
+        photo = await overlay_photo(image_url, job['custom_text'], job['ticker'])
+    try:
+        message = await application.bot.send_photo(
+            chat_id=job['chat_id'],
+            photo=photo,
+            caption=job['caption'],
+            reply_to_message_id=job['reply_to_message_id'],
+            allow_sending_without_reply=True
+        )
+        await GENERATION_JOURNAL.finish(job_id, DELIVERED)
+        remember_meme(message, job['caption'], job['prompt'], image_url, job['user_id'], job['ticker'], photo, custom_text=job['custom_text'])
+        logger.info(f"Delivered resumed job {job_id} to chat {job['chat_id']}")
+    except TelegramError as e:
+        logger.error(f"Failed to deliver resumed job {job_id}: {str(e)}")
+        await GENERATION_JOURNAL.finish(job_id, FAILED)
+
+async def resume_journaled_jobs(application):
+    await GENERATION_JOURNAL.prune(JOURNAL_KEEP_FINISHED)
+    jobs = await GENERATION_JOURNAL.unfinished()
+    if jobs:
+        logger.info(f"Resuming {len(jobs)} unfinished generation jobs")
+    await asyncio.gather(*(resume_journaled_job(application, job) for job in jobs))
+
+async def start_background_services(application):
+    LOOP_WATCHDOG.start()
+    RESPONSES.start()
+    VOCABULARY.start()
+    HOLDER_GATE.start()
+    GALLERY.start()
+    if WARM_POOL_ENABLED:
+        WARM_POOL.start()
+    task = asyncio.create_task(resume_journaled_jobs(application))
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+
+async def stop_background_services(application):
+    await LOOP_WATCHDOG.stop()
+    await RESPONSES.stop()
+    await VOCABULARY.stop()
+    await HOLDER_GATE.stop()
+    await WARM_POOL.stop()
+    # Journaled predictions keep running; the next process resumes and delivers them
+    await IMAGE_ROUTER.close(keep=set(GENERATION_JOURNAL.submitted))
+    GENERATION_JOURNAL.close()
+    if ARCHIVE_TASKS:
+        await asyncio.wait(ARCHIVE_TASKS, timeout=10)
+    if DOWNLOAD_CLIENT is not None:
+        await DOWNLOAD_CLIENT.aclose()
+    if IMAGE_WORKERS is not None:
+        IMAGE_WORKERS.shutdown(wait=False, cancel_futures=True)
+    await SUI_RPC.close()
+    await MEME_INDEX.close()
+    await GALLERY.close()
+    if SETTINGS_SAVE['task'] is not None:
+        SETTINGS_SAVE['task'].cancel()
+        SETTINGS_SAVE['task'] = None
+        await write_all_chat_settings()
+
 @app.on_event("startup")
 async def startup():
     if USE_WEBHOOK:
         logger.info("Setting up webhook...")
         await application.initialize()
-        await application.bot.set_webhook(url=WEBHOOK_URL)
+        await start_background_services(application)
+        # Runs the update fetcher, so webhook updates go through the same ordered processor as polling
+        await application.start()
+        await application.bot.set_webhook(url=WEBHOOK_URL, allowed_updates=ALLOWED_UPDATES, secret_token=WEBHOOK_SECRET)
         logger.info(f"Webhook set to {WEBHOOK_URL}")
 
 @app.on_event("shutdown")
 async def shutdown():
     if USE_WEBHOOK:
         logger.info("Shutting down...")
+        await application.stop()
+        await stop_background_services(application)
         await application.shutdown()
 
+# Gallery API: memes from groups and channels (never private chats), newest first.
+# Pass the returned next_cursor back as cursor for the next page. Needs GALLERY_API_KEY.
+@app.get("/gallery")
+async def gallery_endpoint(request: Request, q: str = "", chat_id: int | None = None, cursor: int | None = None,
+                           limit: int = 20, key: str = ""):
+    if GALLERY_API_KEY_BYTES is None:
+        return Response(status_code=404)
+    key = request.headers.get("x-api-key", key)
+    if not hmac.compare_digest(key.encode("utf-8"), GALLERY_API_KEY_BYTES):
+        metrics.inc("gallery.api_rejected")
+        return Response(status_code=403)
+    limit = max(1, min(limit, GALLERY_API_MAX_LIMIT))
+    rows, next_cursor = await GALLERY.search(q, chat_id=chat_id, before=cursor, limit=limit, include_private=False)
+    for row in rows:
+        del row['user_id']
+        row['image_path'] = f"/images/{row['image_digest']}" if row['image_digest'] else None
+    return {'items': rows, 'next_cursor': next_cursor}
+
+# Stored images by digest. FileResponse streams from disk (zero-copy where the server supports
+# pathsend) and handles Range requests; the digest doubles as a strong ETag.
+@app.get("/images/{digest}")
+async def image_endpoint(digest: str, request: Request):
+    digest = digest.split(".", 1)[0].lower()
+    found = IMAGE_STORE.lookup(digest)
+    if found is None:
+        return Response(status_code=404)
+    path, media_type = found
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in if_none_match or if_none_match == "*":
+        metrics.inc("image_store.not_modified")
+        return Response(status_code=304, headers=headers)
+    metrics.inc("image_store.served")
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    snapshot = metrics.snapshot()
+    snapshot['loop_stalls'] = LOOP_WATCHDOG.snapshot()
+    snapshot['deepest_chat_queues'] = UPDATE_PROCESSOR.chat_depths()
+    return snapshot
+
+# Reads the body in chunks, giving up (None) as soon as it exceeds the limit
+async def read_limited_body(request, limit):
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def reject_webhook(reason, status_code):
+    metrics.inc(f"webhook.rejected.{reason}")
+    return Response(status_code=status_code)
+
 @app.post("/webhook")
 async def webhook(request: Request):
-    update = Update.de_json(await request.json(), application.bot)
-    await application.process_update(update)
+    # Cheapest checks first: secret header, content type and declared size, before reading the body
+    secret = request.headers.get("x-telegram-bot-api-secret-token", "")
+    if not hmac.compare_digest(secret.encode("utf-8"), WEBHOOK_SECRET_BYTES):
+        return reject_webhook("secret", 403)
+    if not request.headers.get("content-type", "").startswith("application/json"):
+        return reject_webhook("content_type", 415)
+    content_length = request.headers.get("content-length")
+    if content_length is not None and (not content_length.isdigit() or int(content_length) > WEBHOOK_MAX_BODY):
+        return reject_webhook("too_large", 413)
+    body = await read_limited_body(request, WEBHOOK_MAX_BODY)
+    if body is None:
+        return reject_webhook("too_large", 413)
+    try:
+        data = json_loads(body) if FAST_WEBHOOK else json.loads(body)
+    except ValueError:
+        return reject_webhook("bad_json", 400)
+    if not is_allowed_update(data, ALLOWED_UPDATE_SET):
+        metrics.inc("webhook.dropped_update_type")
+        return {"status": "ignored"}
+    try:
+        update = Update.de_json(data, application.bot)
+    except (TypeError, ValueError, AttributeError, KeyError) as e:
+        # A 5xx would make Telegram redeliver the same bad update forever
+        logger.warning(f"Dropping malformed webhook update: {str(e)}")
+        return reject_webhook("bad_update", 400)
+    await application.update_queue.put(update)
+    if FAST_WEBHOOK:
+        return Response(content=WEBHOOK_OK_BODY, media_type="application/json")
     return {"status": "ok"}
 
-# Initialize application
-application = Application.builder().token(TELEGRAM_TOKEN).build()
+# Initialize application; updates run concurrently across chats, in order within a chat
+DISPATCH_CONCURRENCY = int(os.getenv("DISPATCH_CONCURRENCY", 32))  # max updates handled at once
+UPDATE_PROCESSOR = ChatOrderedUpdateProcessor(DISPATCH_CONCURRENCY)
+application = (
+    Application.builder()
+    .token(TELEGRAM_TOKEN)
+    .concurrent_updates(UPDATE_PROCESSOR)
+    .post_init(start_background_services)
+    .post_shutdown(stop_background_services)
+    .build()
+)
 
 # Add handlers
-application.add_handler(CommandHandler(["SUIMEME", "suimeme"], suimeme))
+# block=False: generation runs in its own task, so a slow meme doesn't hold the chat's update queue
+application.add_handler(CommandHandler(["SUIMEME", "suimeme"], suimeme, block=False))
 application.add_handler(CommandHandler(["hey", "HEY"], hey))
+application.add_handler(CommandHandler(["price", "PRICE"], price))
+application.add_handler(CommandHandler(["link", "LINK"], link))
+application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, new_members))
+application.add_handler(InlineQueryHandler(inline_query))
+application.add_handler(CommandHandler(["gallery", "GALLERY"], gallery))
+application.add_handler(CallbackQueryHandler(gallery_callback, pattern=r"^gallery:"))
 application.add_handler(CommandHandler(["settings", "SETTINGS"], settings))
 application.add_handler(CallbackQueryHandler(button_callback))
-application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_setting_input))
+application.add_handler(MessageHandler(PendingInputFilter(PENDING_SETTINGS) & filters.TEXT & ~filters.COMMAND, handle_setting_input))
 application.add_handler(CommandHandler(["start", "START"], start_com))
 application.add_handler(CommandHandler(["how", "HOW"], how))
 application.add_handler(CommandHandler(["help", "HELP"], help_command))
@@ -814,6 +1449,11 @@ application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
 application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
 application.add_error_handler(error_handler)
 
+# Only subscribe to the update types the handlers above actually consume
+ALLOWED_UPDATES = allowed_updates_for(application)
+ALLOWED_UPDATE_SET = frozenset(ALLOWED_UPDATES)
+logger.info(f"Allowed updates: {ALLOWED_UPDATES}")
+
 def main():
     if not TELEGRAM_TOKEN or not REPLICATE_API_TOKEN:
         logger.error("Missing TELEGRAM_TOKEN or REPLICATE_API_TOKEN")
@@ -824,13 +1464,13 @@ def main():
 
     if USE_WEBHOOK:
         logger.info("Starting bot with webhook...")
-        uvicorn.run(app, host="0.0.0.0", port=PORT)
+        uvicorn.run(app, host="0.0.0.0", port=PORT, **uvicorn_options())
     else:
         logger.info("Starting bot with polling...")
         loop = asyncio.get_event_loop()
         try:
             loop.run_until_complete(application.initialize())
-            loop.run_until_complete(application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True))
+            loop.run_until_complete(application.run_polling(allowed_updates=ALLOWED_UPDATES, drop_pending_updates=True))
         except KeyboardInterrupt:
             logger.info("Bot interrupted, shutting down...")
         except Exception as e:
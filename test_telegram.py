@@ -0,0 +1,281 @@
+import asyncio
+import time
+
+import pytest
+
+import bench_sui_rpc
+from circuit_breaker import AdaptiveConcurrencyLimiter
+from holder_gate import HolderGate
+from image_backend import BackendRouter, LocalStubBackend, PREDICTION_REPLACED
+from meme_index import MemeIndex
+from progress_status import StatusEditCoalescer
+from sui_rpc import SuiRpcClient, SuiRpcError
+
+COIN_TYPE = bench_sui_rpc.COIN_TYPE
+
+# SuiRpcClient against the local mock Sui JSON-RPC server from bench_sui_rpc
+
+@pytest.fixture(scope="module")
+def rpc_url():
+    server, thread, port = bench_sui_rpc.start_server()
+    yield f"http://127.0.0.1:{port}/"
+    server.should_exit = True
+    thread.join()
+
+@pytest.fixture(autouse=True)
+def no_faults():
+    bench_sui_rpc.faults['mode'] = None
+    yield
+    bench_sui_rpc.faults['mode'] = None
+
+# Runs scenario(client) on a fresh client; returns (result, upstream requests/calls it caused)
+def run(url, scenario, **options):
+    async def main():
+        client = SuiRpcClient(url, **options)
+        try:
+            # A hung future must fail the test, not the run
+            return await asyncio.wait_for(scenario(client), 10)
+        finally:
+            await client.close()
+    before = dict(bench_sui_rpc.upstream)
+    result = asyncio.run(main())
+    return result, {key: bench_sui_rpc.upstream[key] - before[key] for key in before}
+
+def test_concurrent_calls_share_one_batch(rpc_url):
+    owners = [f"0x{i:x}" for i in range(20)]
+
+    async def scenario(client):
+        return await asyncio.gather(*(client.get_balance(owner, COIN_TYPE) for owner in owners))
+
+    balances, upstream = run(rpc_url, scenario)
+    assert upstream == {'requests': 1, 'calls': 20}
+    assert [balance['totalBalance'] for balance in balances] == [str(len(owner) * 10 ** 6) for owner in owners]
+
+def test_batches_are_capped_at_max_batch(rpc_url):
+    async def scenario(client):
+        return await asyncio.gather(*(client.get_balance(f"0x{i:x}", COIN_TYPE) for i in range(12)))
+
+    _, upstream = run(rpc_url, scenario, max_batch=5)
+    assert upstream == {'requests': 3, 'calls': 12}
+
+def test_identical_reads_are_coalesced_and_cached(rpc_url):
+    async def scenario(client):
+        first = await asyncio.gather(*(client.get_coin_info(COIN_TYPE) for _ in range(50)))
+        second = await client.get_coin_info(COIN_TYPE)
+        return first, second
+
+    (first, second), upstream = run(rpc_url, scenario)
+    # One suix_getCoinMetadata and one suix_getTotalSupply, in a single batch
+    assert upstream == {'requests': 1, 'calls': 2}
+    assert all(info == second for info in first)
+    assert second['symbol'] == "SUIMEME" and second['decimals'] == 6 and second['supply'] == 1e9
+
+def test_cache_expires_after_ttl(rpc_url):
+    async def scenario(client):
+        counts = []
+        for delay in (0, 0, 0.3):
+            await asyncio.sleep(delay)
+            before = bench_sui_rpc.upstream['calls']
+            await client.get_total_supply(COIN_TYPE)
+            counts.append(bench_sui_rpc.upstream['calls'] - before)
+        return counts
+
+    counts, _ = run(rpc_url, scenario, cache_ttl=0.2)
+    assert counts == [1, 0, 1]
+
+def test_ttl_zero_is_never_cached(rpc_url):
+    async def scenario(client):
+        await client.get_balance("0x1", COIN_TYPE, ttl=0)
+        await client.get_balance("0x1", COIN_TYPE, ttl=0)
+
+    _, upstream = run(rpc_url, scenario)
+    assert upstream['calls'] == 2
+
+def test_per_call_errors_fail_only_that_call(rpc_url):
+    async def scenario(client):
+        return await asyncio.gather(
+            client.call("suix_noSuchMethod", []),
+            client.call("mock_stringError", []),
+            client.get_coin_metadata(COIN_TYPE),
+            return_exceptions=True
+        )
+
+    (unknown, string_error, metadata), upstream = run(rpc_url, scenario)
+    assert upstream['requests'] == 1
+    assert isinstance(unknown, SuiRpcError) and "Method not found" in str(unknown)
+    assert isinstance(string_error, SuiRpcError) and "node is syncing" in str(string_error)
+    assert metadata['symbol'] == "SUIMEME"
+
+def test_failed_reads_are_not_cached(rpc_url):
+    async def scenario(client):
+        bench_sui_rpc.faults['mode'] = "batch_error"
+        with pytest.raises(SuiRpcError):
+            await client.get_coin_metadata(COIN_TYPE)
+        bench_sui_rpc.faults['mode'] = None
+        return await client.get_coin_metadata(COIN_TYPE)
+
+    metadata, upstream = run(rpc_url, scenario)
+    assert metadata['symbol'] == "SUIMEME"
+    assert upstream['requests'] == 2
+
+@pytest.mark.parametrize("mode, message", [
+    ("batch_error", "Too many requests"),
+    ("not_json", "Sui RPC error"),
+    ("not_list", "Invalid batch response"),
+    ("no_ids", "No response for"),
+    ("odd_shapes", "Invalid"),
+])
+def test_malformed_responses_fail_every_caller(rpc_url, mode, message):
+    bench_sui_rpc.faults['mode'] = mode
+
+    async def scenario(client):
+        return await asyncio.gather(
+            client.get_balance("0x1", COIN_TYPE),
+            *(client.get_coin_info(f"0x{1:064x}::odd::{symbol}") for symbol in bench_sui_rpc.ODD_SHAPES),
+            return_exceptions=True
+        )
+
+    (balance, *infos), upstream = run(rpc_url, scenario)
+    assert upstream['requests'] == 1
+    # Odd shapes are well-formed JSON-RPC; only get_coin_info looks inside the results
+    results = infos if mode == "odd_shapes" else [balance] + infos
+    assert all(isinstance(result, SuiRpcError) and message in str(result) for result in results)
+
+def test_unreachable_node_fails_fast():
+    async def scenario(client):
+        with pytest.raises(SuiRpcError):
+            await client.get_coin_metadata(COIN_TYPE)
+
+    run(f"http://127.0.0.1:{bench_sui_rpc.free_port()}/", scenario, timeout=2)
+
+# HolderGate ownership proof, with the sender's transactions served by the mock
+
+ADDRESS = "0x" + "ab" * 32
+
+def transfer(amount, recipient="0x" + "cd" * 32, timestamp=None):
+    return {
+        "digest": "mock",
+        "timestampMs": str(int((time.time() if timestamp is None else timestamp) * 1000)),
+        "balanceChanges": [
+            {"owner": {"AddressOwner": ADDRESS}, "coinType": "0x2::sui::SUI", "amount": str(-amount - 2000000)},
+            {"owner": {"AddressOwner": recipient}, "coinType": "0x2::sui::SUI", "amount": str(amount)},
+        ],
+    }
+
+@pytest.fixture
+def gate_path(tmp_path):
+    bench_sui_rpc.transactions.clear()
+    yield str(tmp_path / "linked_addresses.json")
+    bench_sui_rpc.transactions.clear()
+
+def test_link_needs_the_challenge_transfer(rpc_url, gate_path):
+    async def scenario(client):
+        gate = HolderGate(client, gate_path)
+        error, amount = gate.challenge(1, ADDRESS)
+        assert error is None
+        # Nothing sent yet, then the wrong amount, an old transfer and a transfer to itself
+        assert await gate.confirm(1) is not None
+        bench_sui_rpc.transactions[ADDRESS] = [
+            transfer(amount + 1), transfer(amount, timestamp=time.time() - 3600), transfer(amount, recipient=ADDRESS)
+        ]
+        assert await gate.confirm(1) is not None
+        assert 1 not in gate.addresses
+        bench_sui_rpc.transactions[ADDRESS].insert(0, transfer(amount))
+        assert await gate.confirm(1) is None
+        return gate
+
+    gate, _ = run(rpc_url, scenario)
+    assert gate.addresses == {1: ADDRESS}
+    assert gate.pending_challenge(1) is None
+
+def test_link_challenge_rejects_taken_and_invalid_addresses(rpc_url, gate_path):
+    async def scenario(client):
+        gate = HolderGate(client, gate_path)
+        gate.addresses, gate.owners = {1: ADDRESS}, {ADDRESS: 1}
+        assert gate.challenge(2, ADDRESS.upper().replace("0X", "0x"))[0] is not None
+        assert gate.challenge(2, "0x1234")[0] is not None
+        assert await gate.confirm(2) is not None
+
+    run(rpc_url, scenario)
+
+def test_verify_many_survives_bad_pairs(rpc_url, gate_path):
+    async def scenario(client):
+        gate = HolderGate(client, gate_path)
+        gate.addresses = {1: ADDRESS, 2: "0x" + "cd" * 32}
+        real_get_balance = client.get_balance
+
+        # A node answering null for one owner used to abort the whole sweep with a TypeError
+        async def get_balance(owner, coin_type, ttl=None):
+            return None if owner == ADDRESS else await real_get_balance(owner, coin_type, ttl)
+
+        client.get_balance = get_balance
+        await gate.verify_many([(1, COIN_TYPE), (2, COIN_TYPE), (3, COIN_TYPE)])
+        with pytest.raises(SuiRpcError):
+            await gate.verify(1, COIN_TYPE)
+        return gate
+
+    gate, _ = run(rpc_url, scenario)
+    assert set(gate.balances) == {(2, COIN_TYPE)}
+
+# Image backend routing: breaker, concurrency limit and latency stats
+
+def test_unused_slots_leave_the_concurrency_limit_alone():
+    async def scenario():
+        limiter = AdaptiveConcurrencyLimiter("test", initial_limit=4)
+        for _ in range(20):
+            assert await limiter.acquire()
+            await limiter.release_unused()
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.limit == 4 and limiter.in_flight == 0
+
+def test_replaced_prediction_leaves_backend_stats_alone():
+    async def scenario():
+        router = BackendRouter([LocalStubBackend(latency=1.0)])
+        route = router.routes[0]
+        image_url, error = await router.generate("slime", owner="chat_user")
+        assert image_url is not None and error is None
+        calls, latency, limit = list(route.breaker.calls), route.latency_ewma, route.limiter.limit
+        task = asyncio.create_task(router.generate("slime again", owner="chat_user"))
+        await asyncio.sleep(0.2)
+        assert await router.registry.replace("chat_user")
+        assert await task == (None, PREDICTION_REPLACED)
+        return route, calls, latency, limit
+
+    route, calls, latency, limit = asyncio.run(scenario())
+    assert list(route.breaker.calls) == calls
+    assert route.latency_ewma == latency
+    assert route.limiter.limit == limit and route.limiter.in_flight == 0
+
+def test_edit_clock_forgets_quiet_chats():
+    coalescer = StatusEditCoalescer(min_interval=0.05)
+    for chat_id in range(100):
+        coalescer.record(chat_id)
+    assert coalescer.wait_for(0) > 0
+    time.sleep(0.06)
+    coalescer.record(100)
+    assert list(coalescer.last_edit) == [100]
+    assert coalescer.wait_for(0) <= 0
+
+def test_failed_index_flush_is_saved_later(tmp_path):
+    path = str(tmp_path / "meme_index.jsonl")
+
+    async def scenario():
+        index = MemeIndex(path)
+        append = index._append
+
+        def disk_full(entries):
+            raise OSError("No space left on device")
+
+        index._append = disk_full
+        index.add("k1", "f1", "slime on toilet")
+        await index.close()
+        index._append = append
+        index.add("k2", "f2", "slime in wwe ring")
+        await index.close()
+
+    asyncio.run(scenario())
+    reloaded = MemeIndex(path)
+    reloaded.load()
+    assert [entry[0] for entry in reloaded.entries] == ["k1", "k2"]
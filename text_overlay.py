@@ -0,0 +1,94 @@
+import asyncio
+import functools
+import io
+import logging
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # Pillow is optional; without it images are sent as generated
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FONT = "DejaVuSans-Bold.ttf"
+MAX_CAPTION_LINES = 3
+
+def available():
+    return Image is not None
+
+# Fonts and badge layers are cached per worker process, so only the first job pays for them
+@functools.lru_cache(maxsize=32)
+def _font(font_path, size):
+    try:
+        return ImageFont.truetype(font_path, size)
+    except OSError:
+        logger.warning(f"Font {font_path} not found, using Pillow's default font")
+        return ImageFont.load_default(size)
+
+@functools.lru_cache(maxsize=64)
+def _badge(ticker, font_path, height):
+    font = _font(font_path, int(height * 0.6))
+    left, top, right, bottom = font.getbbox(ticker)
+    padding = height // 3
+    badge = Image.new("RGBA", (right - left + 2 * padding, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(badge)
+    draw.rounded_rectangle((0, 0, badge.width - 1, height - 1), radius=height // 2, fill=(12, 74, 160, 220),
+                           outline=(255, 215, 0, 255), width=max(2, height // 16))
+    draw.text((badge.width // 2, height // 2), ticker, font=font, fill=(255, 255, 255, 255), anchor="mm")
+    return badge
+
+def _wrap(text, font, max_width):
+    lines = []
+    for word in text.split():
+        if lines and font.getlength(f"{lines[-1]} {word}") <= max_width:
+            lines[-1] = f"{lines[-1]} {word}"
+        else:
+            lines.append(word)
+    return lines
+
+# Largest font size (down to a floor) that fits the caption in MAX_CAPTION_LINES lines
+def _fit_caption(text, font_path, width):
+    max_width = width * 0.92
+    size = width // 9
+    while True:
+        font = _font(font_path, size)
+        lines = _wrap(text, font, max_width)
+        if size <= width // 24 or (len(lines) <= MAX_CAPTION_LINES
+                                   and all(font.getlength(line) <= max_width for line in lines)):
+            return font, lines
+        size = int(size * 0.85)
+
+# Draws the caption (meme style, top of the image) and the ticker badge (bottom right).
+# Runs in a worker process: takes and returns encoded image bytes.
+def compose(image_bytes, custom_text, ticker, font_path=DEFAULT_FONT, quality=90):
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    width, height = image.size
+    if custom_text:
+        font, lines = _fit_caption(custom_text.upper(), font_path, width)
+        draw = ImageDraw.Draw(image)
+        line_height = int(font.size * 1.15)
+        y = height // 40
+        for line in lines:
+            draw.text((width // 2, y), line, font=font, fill="white", anchor="ma",
+                      stroke_width=max(2, font.size // 12), stroke_fill="black")
+            y += line_height
+    if ticker:
+        # Heights are bucketed so same-sized images share a cached badge
+        badge = _badge(ticker, font_path, max(24, (height // 14) // 4 * 4))
+        margin = width // 40
+        image.paste(badge, (width - badge.width - margin, height - badge.height - margin), badge)
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+# Runs compose() in a process pool so Pillow work never blocks the event loop
+class TextOverlayRenderer:
+    def __init__(self, executor, font_path=DEFAULT_FONT):
+        self.executor = executor  # () -> concurrent.futures.Executor
+        self.font_path = font_path
+
+    async def render(self, image_bytes, custom_text, ticker):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor(), compose, image_bytes, custom_text, ticker, self.font_path
+        )
@@ -0,0 +1,61 @@
+import re
+
+from prompt_engine import compile_template
+
+# Compiled, read-only vocabulary for one chat: frozensets for membership,
+# precompiled scene/color patterns and a substring index for objects
+class Theme:
+    __slots__ = ('objects', 'styles', 'scenes', 'colors', 'scene_set', 'color_set', 'template',
+                 '_scene_pattern', '_color_pattern', '_object_index', '_canonical')
+
+    def __init__(self, objects, styles, scenes, colors, main_character, ticker):
+        set_attr = object.__setattr__
+        set_attr(self, 'objects', tuple(objects))
+        set_attr(self, 'styles', tuple(styles))
+        set_attr(self, 'scenes', tuple(scenes))
+        set_attr(self, 'colors', tuple(colors))
+        set_attr(self, 'scene_set', frozenset(self.scenes))
+        set_attr(self, 'color_set', frozenset(self.colors))
+        set_attr(self, 'template', compile_template(main_character, ticker, self.as_dict()))
+        set_attr(self, '_scene_pattern', _alternation(self.scenes))
+        set_attr(self, '_color_pattern', _alternation(self.colors))
+        set_attr(self, '_object_index', _object_index(self.objects))
+        set_attr(self, '_canonical', {word.lower(): word for word in self.colors + self.scenes})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Theme is immutable, build a new one instead")
+
+    def as_dict(self):
+        return {'objects': self.objects, 'styles': self.styles, 'scenes': self.scenes, 'colors': self.colors}
+
+    # Classify one lowercased word of user input: ('scene' | 'color' | 'object', value) or None
+    def match_term(self, term):
+        if term == 'moon':
+            return 'scene', 'moon'
+        match = self._scene_pattern.search(term) if self._scene_pattern else None
+        if match:
+            return 'scene', self._canonical[match.group(0).lower()]
+        match = self._color_pattern.search(term) if self._color_pattern else None
+        if match:
+            return 'color', self._canonical[match.group(0).lower()]
+        obj = self._object_index.get(term)
+        if obj:
+            return 'object', obj
+        return None
+
+def _alternation(words):
+    if not words:
+        return None
+    # Longest first so "underwater coral reef" wins over "underwater"
+    ordered = sorted(words, key=len, reverse=True)
+    return re.compile(r'\b(?:' + '|'.join(re.escape(word) for word in ordered) + r')\b', re.IGNORECASE)
+
+# Every substring of every object name maps to the first object containing it
+def _object_index(objects):
+    index = {'rocketship': 'a rocket ship'}
+    for obj in objects:
+        name = obj.replace('a ', '').replace('an ', '').lower()
+        for start in range(len(name)):
+            for end in range(start + 1, len(name) + 1):
+                index.setdefault(name[start:end], obj)
+    return index
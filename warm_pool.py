@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Pre-generated memes for argument-less /SUIMEME requests, filled while the backend is idle
+class WarmPool:
+    def __init__(self, generate, theme_for, is_idle, per_chat_size=2, global_size=20,
+                 hourly_budget=30, per_chat_hourly_budget=6, active_window=3600, max_age=2700,
+                 interval=15, render_options=None):
+        self.generate = generate  # async (prompt, owner) -> (image_url, error)
+        self.theme_for = theme_for  # chat_id -> Theme or None
+        self.is_idle = is_idle  # () -> bool
+        self.per_chat_size = per_chat_size
+        self.global_size = global_size
+        self.hourly_budget = hourly_budget
+        self.per_chat_hourly_budget = per_chat_hourly_budget
+        self.active_window = active_window  # chats without a request for this long stop being filled
+        self.max_age = max_age  # seconds; upstream image URLs expire, so drop older entries
+        self.interval = interval
+        self.render_options = render_options or {}  # extra PromptTemplate.render arguments
+        self.pools = {}  # {chat_id: deque([(prompt, image_url, created_at)])}
+        self.active = {}  # {chat_id: last request timestamp}
+        self.versions = {}  # {chat_id: settings version}, bumped on invalidate
+        self.spent = deque()  # timestamps of pre-generations, global budget
+        self.spent_by_chat = {}  # {chat_id: deque([timestamps])}
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def mark_active(self, chat_id):
+        self.active[chat_id] = time.time()
+
+    # Settings changed: pooled images no longer match the chat's character/ticker
+    def invalidate(self, chat_id):
+        self.versions[chat_id] = self.versions.get(chat_id, 0) + 1
+        dropped = self.pools.pop(chat_id, None)
+        if dropped:
+            metrics.inc("warm_pool.invalidated", len(dropped))
+        self._publish()
+
+    # Ready (prompt, image_url) for the chat, or None
+    def take(self, chat_id):
+        pool = self.pools.get(chat_id)
+        now = time.time()
+        while pool:
+            prompt, image_url, created_at = pool.popleft()
+            if now - created_at <= self.max_age:
+                metrics.inc("warm_pool.hits")
+                self._publish()
+                return prompt, image_url
+            metrics.inc("warm_pool.expired")
+        metrics.inc("warm_pool.misses")
+        return None
+
+    def _publish(self):
+        metrics.set_gauge("warm_pool.size", sum(len(pool) for pool in self.pools.values()))
+        metrics.set_gauge("warm_pool.chats", len(self.pools))
+
+    def _within_budget(self, chat_id, now):
+        while self.spent and now - self.spent[0] > 3600:
+            self.spent.popleft()
+        chat_spent = self.spent_by_chat.setdefault(chat_id, deque())
+        while chat_spent and now - chat_spent[0] > 3600:
+            chat_spent.popleft()
+        return len(self.spent) < self.hourly_budget and len(chat_spent) < self.per_chat_hourly_budget
+
+    # Active chat with the emptiest pool that still has budget
+    def _next_chat(self, now):
+        for chat_id, last_seen in list(self.active.items()):
+            if now - last_seen > self.active_window:
+                del self.active[chat_id]
+                self.pools.pop(chat_id, None)
+                self.spent_by_chat.pop(chat_id, None)
+        if sum(len(pool) for pool in self.pools.values()) >= self.global_size:
+            return None
+        candidates = [
+            chat_id for chat_id in self.active
+            if len(self.pools.get(chat_id, ())) < self.per_chat_size and self._within_budget(chat_id, now)
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda chat_id: len(self.pools.get(chat_id, ())))
+
+    async def _fill_one(self, chat_id):
+        theme = self.theme_for(chat_id)
+        if theme is None:
+            return
+        version = self.versions.get(chat_id, 0)
+        prompt = theme.template.render(seed=random.getrandbits(32), **self.render_options)
+        now = time.time()
+        self.spent.append(now)
+        self.spent_by_chat.setdefault(chat_id, deque()).append(now)
+        metrics.inc("warm_pool.generations")
+        image_url, error = await self.generate(prompt, f"warm:{chat_id}")
+        if error:
+            logger.warning(f"Warm pool generation for chat {chat_id} failed: {error}")
+            return
+        if self.versions.get(chat_id, 0) != version or chat_id not in self.active:
+            # Settings changed (or chat went quiet) while generating
+            metrics.inc("warm_pool.discarded")
+            return
+        self.pools.setdefault(chat_id, deque()).append((prompt, image_url, time.time()))
+        self._publish()
+        logger.info(f"Warm pool for chat {chat_id} now holds {len(self.pools[chat_id])} memes")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if not self.is_idle():
+                    continue
+                chat_id = self._next_chat(time.time())
+                if chat_id is not None:
+                    await self._fill_one(chat_id)
+            except Exception as e:
+                logger.error(f"Warm pool error: {str(e)}")